@@ -0,0 +1,477 @@
+"""
+Benchmarks
+
+Benchmarks for the slower parts of the build pipeline. Each benchmark is a subcommand:
+
+python benchmarks.py data-format [FILES ...] [--synthetic N]
+    Compares parse time and disk footprint of GeoJSON listing files against the compact
+    .mlspack format. --synthetic adds a file of N generated listings (see dummy_listing.py).
+
+python benchmarks.py ingest [--sizes 1000 10000 100000] [--mode collect|stream|parallel] ...
+    Downloads synthetic feeds from the local SimplyRETS stand-in (mock_simplyrets.py) and reports
+    listings/second, retries and peak resident memory for each feed size. Latency, error and 429
+    rates, page size and worker count can be set to tune the downloader offline.
+
+python benchmarks.py map-filter [--listings 25000] [--queries 200]
+    Builds the map tiles and facet indexes (map_maker.py) for generated listings and compares the
+    latency of answering the map filters from the indexes against scanning every listing. Each
+    query uses a random viewport and a random mix of the price, bedroom, bathroom and type filters.
+
+python benchmarks.py search [--listings 25000] [--queries 200]
+    Builds the search index (search_index.py) for generated listings, checks the indexed answer
+    to random queries against scanning every listing, and reports the index build time, the shard
+    sizes and how many bytes the search page downloads per query.
+
+python benchmarks.py templates [--template-dir template] [--renders 2000]
+    Renders the master, listing and listing content templates with string.Template and with the
+    compiled templates of template_engine.py, checks that both give the same output and compares
+    the time per render, with and without re-loading the template from disk for every page.
+
+python benchmarks.py list-pages [--sizes 1000 25000 100000] [--views FILE]
+    Builds the paginated listing views (listing_list_page.py) for generated listings of each size
+    and reports the time per listing and per page, which stay flat when the build scales
+    linearly, and the peak memory the views allocate, from a second, traced run. The three
+    default views are built unless a view definition file is given.
+
+python benchmarks.py listing-pages [--listings 5000] [--workers 1 2 4 8]
+    Renders listing pages for generated listings with listing_pages_generator.py at each worker
+    count, reports pages/second and checks every run writes the same pages as the first one.
+"""
+import argparse
+import filecmp
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left, bisect_right
+from string import Template
+
+import requests
+
+import downloadmls
+import dummy_listing
+import listing_list_page
+import listing_pages_generator
+import map_maker
+import mock_simplyrets
+import search_index
+import template_engine
+from listing_data import load_listings, save_listings
+from listing_model import Listing
+from mls_convert import simplify_feature
+
+def best_time(func, *args, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def bench_data_format(args):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        files = list(args.files)
+        if args.synthetic:
+            synthetic_path = os.path.join(temp_dir, f'synthetic_{args.synthetic}.geojson')
+            with open(synthetic_path, 'w') as file:
+                json.dump(dummy_listing.generate_test_data(args.synthetic), file, indent=4)
+            files.append(synthetic_path)
+
+        print(f"{'file':<40} {'listings':>9} {'geojson':>10} {'mlspack':>10} {'json load':>10} {'pack load':>10}")
+        for path in files:
+            data = load_listings(path)
+            compact_path = os.path.join(temp_dir, os.path.basename(path) + '.mlspack')
+            save_listings(data, compact_path)
+
+            json_time = best_time(load_listings, path, repeat=args.repeat)
+            compact_time = best_time(load_listings, compact_path, repeat=args.repeat)
+            json_size = os.path.getsize(path)
+            compact_size = os.path.getsize(compact_path)
+
+            label = path if path in args.files else os.path.basename(path)
+            print(f"{label:<40} {len(data['features']):>9} "
+                  f"{json_size / 1024:>8.1f}KB {compact_size / 1024:>8.1f}KB "
+                  f"{json_time * 1000:>8.2f}ms {compact_time * 1000:>8.2f}ms")
+
+def serve_mock(config_kwargs, url_queue):
+    server = mock_simplyrets.start_mock_server(mock_simplyrets.MockConfig(**config_kwargs))
+    url_queue.put(server.url)
+    threading.Event().wait()
+
+def run_ingest(args, output_path):
+    session = downloadmls.create_session('bench', 'bench', 1, api_url=args.api_url)
+    if args.mode == 'stream':
+        return downloadmls.stream_all_properties('bench', 'bench', output_path, limit=args.page_size,
+                                                 session=session, api_url=args.api_url)
+    if args.mode == 'parallel':
+        shards = downloadmls.build_shards('status', downloadmls.DEFAULT_STATUS_SHARDS)
+        return len(downloadmls.process_properties_parallel('bench', 'bench', shards, workers=args.workers,
+                                                           limit=args.page_size, api_url=args.api_url))
+    return len(downloadmls.process_all_properties('bench', 'bench', session=session, limit=args.page_size,
+                                                  api_url=args.api_url))
+
+def ingest_worker(args, result_queue):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.perf_counter()
+        fetched = run_ingest(args, os.path.join(temp_dir, 'mls_data.geojson'))
+        elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result_queue.put((fetched, elapsed, peak_kb))
+
+def bench_ingest(args):
+    print(f"mode={args.mode} page size={args.page_size} latency={args.latency}s "
+          f"error rate={args.error_rate} throttle rate={args.throttle_rate}")
+    print(f"{'listings':>9} {'fetched':>9} {'seconds':>9} {'listings/s':>11} {'requests':>9} {'retries':>8} {'peak MB':>8}")
+
+    # Server and client each get a fresh process: the server does not compete with the client for
+    # the GIL, and the client's peak RSS only reflects the download being measured
+    context = multiprocessing.get_context('spawn')
+    for count in args.sizes:
+        url_queue = context.Queue()
+        config = dict(count=count, latency=args.latency, error_rate=args.error_rate,
+                      throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+        server = context.Process(target=serve_mock, args=(config, url_queue), daemon=True)
+        server.start()
+        try:
+            args.api_url = url_queue.get(timeout=30)
+            result_queue = context.Queue()
+            client = context.Process(target=ingest_worker, args=(args, result_queue))
+            client.start()
+            fetched, elapsed, peak_kb = result_queue.get()
+            client.join()
+            stats = requests.get(args.api_url.replace('/properties', '/stats')).json()
+        finally:
+            server.terminate()
+            server.join()
+
+        print(f"{count:>9} {fetched:>9} {elapsed:>9.2f} {fetched / elapsed:>11.0f} {stats['requests']:>9} "
+              f"{stats['errors'] + stats['throttled']:>8} {peak_kb / 1024:>8.1f}")
+
+def scan_listings(features, bounds, max_price=None, min_bedrooms=None, min_bathrooms=None, sub_type=None):
+    # The per-listing check updateVisibleListings in map_template.html runs on every move
+    west, south, east, north = bounds
+    matches = []
+    for number, feature in enumerate(features):
+        lng, lat = feature["geometry"]["coordinates"][:2]
+        properties = feature["properties"]
+        if (west <= lng <= east and south <= lat <= north and
+                (max_price is None or (properties["listPrice"] is not None and properties["listPrice"] <= max_price)) and
+                (min_bedrooms is None or (properties["bedrooms"] is not None and properties["bedrooms"] >= min_bedrooms)) and
+                (min_bathrooms is None or (properties["bathrooms"] is not None and properties["bathrooms"] >= min_bathrooms)) and
+                (not sub_type or properties["subType"] == sub_type)):
+            matches.append(number)
+    return matches
+
+def random_map_query(rng, bounds):
+    west, south, east, north = bounds
+    width, height = (east - west) * rng.uniform(0.05, 0.6), (north - south) * rng.uniform(0.05, 0.6)
+    query_west, query_south = rng.uniform(west, east - width), rng.uniform(south, north - height)
+    return {
+        "bounds": [query_west, query_south, query_west + width, query_south + height],
+        "max_price": rng.choice([None, rng.randrange(100000, 1500000, 50000)]),
+        "min_bedrooms": rng.choice([None, rng.randint(1, 5)]),
+        "min_bathrooms": rng.choice([None, rng.randint(1, 3)]),
+        "sub_type": rng.choice([None, "SingleFamilyResidence", "Townhouse", "Condominium"])
+    }
+
+def bench_map_filter(args):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    listings = dummy_listing.generate_test_data(args.listings)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        listings_path = os.path.join(temp_dir, 'mls_data.geojson')
+        save_listings({"type": "FeatureCollection",
+                       "features": [simplify_feature(feature) for feature in listings["features"]]},
+                      listings_path)
+        points = map_maker.load_map_points(listings_path)
+
+        start = time.perf_counter()
+        index = map_maker.generate_tiles(points, temp_dir)
+        build_time = time.perf_counter() - start
+        facets_dir = os.path.join(temp_dir, 'tiles', 'facets')
+        index_size = sum(os.path.getsize(os.path.join(facets_dir, name)) for name in os.listdir(facets_dir))
+
+        tiles_dir = os.path.join(temp_dir, 'tiles')
+        facets = map_maker.load_facets(tiles_dir)
+        # Listings in the order the facet indexes number them
+        features = []
+        for z, x, y, _ in index["tiles"]:
+            with open(os.path.join(tiles_dir, str(z), str(x), f"{y}.json"), 'r') as file:
+                features.extend(json.load(file)["features"])
+
+    queries = [random_map_query(rng, index["bounds"]) for _ in range(args.queries)]
+    scan_times, index_times, mismatches, matched = [], [], 0, 0
+    for query in queries:
+        start = time.perf_counter()
+        expected = scan_listings(features, **query)
+        scan_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        result = map_maker.query_facets(facets, **query)
+        index_times.append(time.perf_counter() - start)
+        mismatches += result != expected
+        matched += len(result)
+
+    scan_times.sort()
+    index_times.sort()
+    print(f"{len(features)} listings, facet indexes built with the tiles in {build_time:.2f}s, "
+          f"{index_size / 1024:.1f}KB on disk")
+    print(f"{len(queries)} queries, {matched / len(queries):.0f} matches on average, {mismatches} mismatches")
+    print(f"{'':<8} {'median':>10} {'p95':>10} {'max':>10}")
+    for label, timings in (('scan', scan_times), ('indexes', index_times)):
+        print(f"{label:<8} {timings[len(timings) // 2] * 1000:>8.2f}ms "
+              f"{timings[int(len(timings) * 0.95)] * 1000:>8.2f}ms {timings[-1] * 1000:>8.2f}ms")
+
+def scan_search(listings, text, min_price=None, max_price=None, min_bedrooms=None):
+    # The MLS ids a search without an index finds, by tokenizing and checking every listing
+    tokens = search_index.tokenize(text)
+    matches = set()
+    if not tokens:
+        return matches
+    for listing in listings:
+        words = set(search_index.tokenize(search_index.listing_text(listing)))
+        if (all(token in words for token in tokens[:-1]) and any(word.startswith(tokens[-1]) for word in words) and
+                (min_price is None or (listing.list_price is not None and listing.list_price >= min_price)) and
+                (max_price is None or (listing.list_price is not None and listing.list_price <= max_price)) and
+                (min_bedrooms is None or (listing.bedrooms or 0) >= min_bedrooms)):
+            matches.add(listing.mls_id)
+    return matches
+
+def random_search_query(rng, listings):
+    # One or two neighbouring words of a random listing, the last one cut short as if still being typed
+    words = search_index.tokenize(search_index.listing_text(rng.choice(listings)))
+    count = rng.randint(1, 2)
+    start = rng.randrange(max(1, len(words) - count + 1))
+    chosen = words[start:start + count]
+    chosen[-1] = chosen[-1][:rng.randint(search_index.PREFIX_LENGTH, len(chosen[-1]))]
+    return {
+        "text": ' '.join(chosen),
+        "min_price": rng.choice([None, rng.randrange(50000, 800000, 50000)]),
+        "max_price": rng.choice([None, rng.randrange(400000, 1500000, 50000)]),
+        "min_bedrooms": rng.choice([None, rng.randint(1, 5)])
+    }
+
+def query_download_size(search_dir, index, query, matches):
+    """Bytes search.html downloads for a query: the index, shards, price chunks, bedrooms and shown results."""
+    tokens = search_index.tokenize(query["text"])
+    paths = {'index.json'}
+    for position, token in enumerate(tokens):
+        paths.update(f"shards/{prefix}.json"
+                     for prefix in search_index.shard_prefixes(index, token, position == len(tokens) - 1))
+    for price, search in ((query["min_price"], bisect_left), (query["max_price"], bisect_right)):
+        if price is not None and index["priceSteps"]:
+            paths.add(f"prices/{max(0, search(index['priceSteps'], price) - 1)}.bin")
+    if query["min_bedrooms"] is not None:
+        # The bedrooms are read for every listing that passed the words and the price
+        candidates = search_index.query_search_index(search_dir, query["text"], query["min_price"], query["max_price"])
+        paths.update(f"bedrooms/{number // index['bedroomChunk']}.bin" for number in candidates)
+    paths.update(f"docs/{number // index['docChunk']}.json" for number in matches[:search_index.MAX_SHOWN_RESULTS])
+    return sum(os.path.getsize(os.path.join(search_dir, path)) for path in paths)
+
+def bench_search(args):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    features = dummy_listing.generate_test_data(args.listings)["features"]
+    listings = [Listing(feature) for feature in features]
+    queries = [random_search_query(rng, listings) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        listings_path = os.path.join(temp_dir, 'mls_data.geojson')
+        save_listings({"type": "FeatureCollection", "features": features}, listings_path)
+        index = search_index.build_search_index(listings, temp_dir)
+        search_dir = os.path.join(temp_dir, search_index.SEARCH_DIR)
+
+        # MLS ids in the order the index numbers the listings
+        mls_ids = []
+        for chunk in range((index["count"] + index["docChunk"] - 1) // index["docChunk"]):
+            with open(os.path.join(search_dir, 'docs', f"{chunk}.json"), 'r') as file:
+                mls_ids.extend(doc[0] for doc in json.load(file))
+
+        query_times, sizes, mismatches, matched = [], [], 0, 0
+        for query in queries:
+            start = time.perf_counter()
+            result = search_index.query_search_index(search_dir, query["text"], query["min_price"],
+                                                     query["max_price"], query["min_bedrooms"])
+            query_times.append(time.perf_counter() - start)
+            mismatches += {mls_ids[number] for number in result} != scan_search(listings, **query)
+            matched += len(result)
+            sizes.append(query_download_size(search_dir, index, query, result))
+        listings_size = os.path.getsize(listings_path)
+
+    query_times.sort()
+    sizes.sort()
+    shard_sizes = sorted(index["shards"].values())
+    print(f"{len(queries)} queries, {matched / len(queries):.0f} matches on average, {mismatches} mismatches")
+    print(f"shards: median {shard_sizes[len(shard_sizes) // 2] / 1024:.1f}KB, largest {shard_sizes[-1] / 1024:.1f}KB")
+    print(f"query time: median {query_times[len(query_times) // 2] * 1000:.2f}ms, "
+          f"p95 {query_times[int(len(query_times) * 0.95)] * 1000:.2f}ms")
+    print(f"downloaded per query: median {sizes[len(sizes) // 2] / 1024:.1f}KB, "
+          f"p95 {sizes[int(len(sizes) * 0.95)] / 1024:.1f}KB (the listing file is {listings_size / 1024:.0f}KB)")
+
+def render_template(template, mapping, renders):
+    for _ in range(renders):
+        template.safe_substitute(mapping)
+
+def render_string_template(path, mapping, renders):
+    # What the generators did before: read and parse the template for every page
+    for _ in range(renders):
+        with open(path, 'r') as file:
+            Template(file.read()).safe_substitute(mapping)
+
+def render_compiled_template(path, mapping, renders):
+    for _ in range(renders):
+        template_engine.load_template(path).safe_substitute(mapping)
+
+def bench_templates(args):
+    page_content = '<div class="listing">' + 'Listing details. ' * 200 + '</div>'
+    cases = [
+        ('filled_master_template.html', {'content': page_content, 'title': 'Listings - Page 1'}),
+        ('listing_template.html', {'fullAddress': '123 Main St, Houston, Texas 77095', 'listPrice': '$450,000',
+                                   'bedrooms': 3, 'bathrooms': 2.5, 'area': 2100, 'mlsId': 1005160,
+                                   'featuredImage': 'https://example.com/photo.jpg', 'featuredImageAttributes': ''}),
+        ('listing_content_template.html', {'remarks': 'Remarks. ' * 50, 'address': '123 Main St',
+                                           'listPrice': '$450,000', 'image_gallery': '<img src="a.jpg">' * 8,
+                                           'interior_features': page_content, 'exterior_features': '',
+                                           'area_lot_features': '', 'financial_features': '',
+                                           'mls_attribution': ''}),
+    ]
+
+    print(f"{'template':<32} {'same output':>11} {'Template':>10} {'compiled':>10} {'reload':>10} {'cached':>10}")
+    for name, mapping in cases:
+        path = os.path.join(args.template_dir, name)
+        with open(path, 'r') as file:
+            text = file.read()
+        parsed = Template(text)
+        compiled = template_engine.CompiledTemplate(text)
+        same = parsed.safe_substitute(mapping) == compiled.safe_substitute(mapping)
+
+        # Time per render, in microseconds
+        template_time = best_time(render_template, parsed, mapping, args.renders)
+        compiled_time = best_time(render_template, compiled, mapping, args.renders)
+        reload_time = best_time(render_string_template, path, mapping, args.renders)
+        cached_time = best_time(render_compiled_template, path, mapping, args.renders)
+        print(f"{name:<32} {'yes' if same else 'NO':>11} " +
+              ' '.join(f"{timing / args.renders * 1e6:>8.1f}us"
+                       for timing in (template_time, compiled_time, reload_time, cached_time)))
+
+def bench_list_pages(args):
+    views = listing_list_page.load_views(args.views)
+    listing_template = template_engine.load_template(os.path.join(args.template_dir, 'listing_template.html'))
+    master_template = template_engine.load_template(os.path.join(args.template_dir, 'filled_master_template.html'))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        print(f"{'listings':>9} {'pages':>7} {'seconds':>9} {'us/listing':>11} {'ms/page':>9} {'MB written':>11} "
+              f"{'peak MB':>8}")
+        for size in args.sizes:
+            random.seed(args.seed)
+            listings = [Listing(feature) for feature in dummy_listing.generate_test_data(size)["features"]]
+            output_dir = os.path.join(temp_dir, str(size))
+            os.makedirs(output_dir)
+
+            start = time.perf_counter()
+            generated_files = listing_list_page.generate_views(listings, views, listing_template, master_template,
+                                                               output_dir)
+            elapsed = time.perf_counter() - start
+
+            written = sum(os.path.getsize(path) for path in generated_files)
+
+            # Memory is measured on a second run, so tracing does not slow down the timed one. The
+            # peak only counts what the views allocate, not the listings themselves.
+            tracemalloc.start()
+            try:
+                listing_list_page.generate_views(listings, views, listing_template, master_template, output_dir)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+            print(f"{size:>9} {len(generated_files):>7} {elapsed:>9.2f} {elapsed / size * 1e6:>11.1f} "
+                  f"{elapsed / len(generated_files) * 1000:>9.3f} {written / 1024 / 1024:>11.1f} "
+                  f"{peak / 1024 / 1024:>8.1f}")
+            shutil.rmtree(output_dir)
+
+def bench_listing_pages(args):
+    random.seed(args.seed)
+    listings = [Listing(feature) for feature in dummy_listing.generate_test_data(args.listings)["features"]]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        print(f"{'workers':>7} {'seconds':>9} {'pages/s':>9} {'same pages':>11}")
+        first_dir = None
+        for workers in args.workers:
+            output_dir = os.path.join(temp_dir, f'workers_{workers}')
+            os.makedirs(output_dir)
+            start = time.perf_counter()
+            created_files = listing_pages_generator.render_pages(listings, args.template_dir, output_dir,
+                                                                 workers=workers)
+            elapsed = time.perf_counter() - start
+
+            names = sorted(os.path.basename(path) for path in created_files)
+            if first_dir is None:
+                first_dir, first_names = output_dir, names
+            _, mismatch, errors = filecmp.cmpfiles(first_dir, output_dir, first_names, shallow=False)
+            same = names == first_names and not mismatch and not errors
+            print(f"{workers:>7} {elapsed:>9.2f} {len(created_files) / elapsed:>9.0f} {'yes' if same else 'NO':>11}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the site build pipeline.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    data_format = subparsers.add_parser('data-format', help='GeoJSON versus compact listing files')
+    data_format.add_argument('files', nargs='*', default=['mls_data.geojson', 'template/mls_data.geojson'],
+                             help='Listing files to measure')
+    data_format.add_argument('--synthetic', type=int, default=0, help='Also measure N generated listings')
+    data_format.add_argument('--repeat', type=int, default=5, help='Runs per measurement (best is reported)')
+    data_format.set_defaults(func=bench_data_format)
+
+    ingest = subparsers.add_parser('ingest', help='Download throughput against the local mock API')
+    ingest.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Feed sizes to test')
+    ingest.add_argument('--mode', choices=['collect', 'stream', 'parallel'], default='collect',
+                        help='collect: process_all_properties, stream: stream_all_properties, '
+                             'parallel: process_properties_parallel sharded by status')
+    ingest.add_argument('--page-size', type=int, default=500, help='Listings requested per page')
+    ingest.add_argument('--workers', type=int, default=4, help='Worker threads for the parallel mode')
+    ingest.add_argument('--latency', type=float, default=0.0, help='Mock server delay per response, in seconds')
+    ingest.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail with a 500')
+    ingest.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests that get a 429')
+    ingest.add_argument('--retry-after', type=int, default=1, help='Retry-After sent with 429 responses')
+    ingest.set_defaults(func=bench_ingest)
+
+    map_filter = subparsers.add_parser('map-filter', help='Map filter latency with and without the facet indexes')
+    map_filter.add_argument('--listings', type=int, default=25000, help='Number of generated listings')
+    map_filter.add_argument('--queries', type=int, default=200, help='Number of random filter queries')
+    map_filter.add_argument('--seed', type=int, default=0, help='Seed for the listings and the queries')
+    map_filter.set_defaults(func=bench_map_filter)
+
+    search = subparsers.add_parser('search', help='Search index size, accuracy and bytes per query')
+    search.add_argument('--listings', type=int, default=25000, help='Number of generated listings')
+    search.add_argument('--queries', type=int, default=200, help='Number of random queries')
+    search.add_argument('--seed', type=int, default=0, help='Seed for the listings and the queries')
+    search.set_defaults(func=bench_search)
+
+    templates = subparsers.add_parser('templates', help='string.Template versus compiled templates')
+    templates.add_argument('--template-dir', default='template', help='Directory of the HTML templates')
+    templates.add_argument('--renders', type=int, default=2000, help='Renders per measurement')
+    templates.set_defaults(func=bench_templates)
+
+    list_pages = subparsers.add_parser('list-pages', help='Paginated listing views by number of listings')
+    list_pages.add_argument('--sizes', type=int, nargs='+', default=[1000, 25000, 100000],
+                            help='Numbers of generated listings to test')
+    list_pages.add_argument('--views', help='View definition file (default: the three built-in views)')
+    list_pages.add_argument('--template-dir', default='template', help='Directory of the HTML templates')
+    list_pages.add_argument('--seed', type=int, default=0, help='Seed for the generated listings')
+    list_pages.set_defaults(func=bench_list_pages)
+
+    listing_pages = subparsers.add_parser('listing-pages', help='Listing page throughput by worker count')
+    listing_pages.add_argument('--listings', type=int, default=5000, help='Number of generated listings')
+    listing_pages.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to test')
+    listing_pages.add_argument('--template-dir', default='template', help='Directory of the HTML templates')
+    listing_pages.add_argument('--seed', type=int, default=0, help='Seed for the generated listings')
+    listing_pages.set_defaults(func=bench_listing_pages)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
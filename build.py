@@ -0,0 +1,351 @@
+"""
+Site Build
+
+Builds the whole site in one process, replacing the separate scripts run by
+rebuild_all_pages.sh. The steps of the build are stages with the stages they depend on:
+
+    master_template                    generate_template.py
+    listings                           parses mls_data.geojson for the stages below
+    photos         <- listings         photo_cache.py
+    map            <- master_template  map_maker.py
+    testimonials   <- master_template  testimonials.py
+    listing_pages  <- master_template, listings, photos   listing_pages_generator.py
+    list_pages     <- master_template, listings, photos   listing_list_page.py
+    search         <- master_template, listings   search_index.py
+    generic_pages  <- master_template  generic_page.py
+    publish        <- every other stage (only with --publish)   publish.py
+
+A stage starts as soon as the stages it depends on have finished, on a pool of --workers threads,
+so stages that do not depend on each other run at the same time. Shared inputs are parsed once:
+the listing files go through one data context (see generic_page.py) that every stage and every
+shortcode reads from, and the compiled templates are kept by template_engine.py. A failed stage
+is reported, and the stages that depend on it are skipped.
+
+Every stage returns the files it produced. The build writes a JSON trace with the wall time, the
+CPU time of the stage's thread, the peak RSS of the process when the stage finished, and the
+number and bytes of the files the stage wrote, so it is clear where rebuild time goes.
+
+To run the script:
+python build.py template dummyweb --workers 4 --trace .build_cache/build_trace.json
+
+Where:
+- `template` is the template directory and `dummyweb` the output directory.
+- --stages builds only the given stages and the stages they depend on.
+- --from builds the given stages and the stages that depend on them, e.g. `--from master_template`
+  after editing data.json.
+- --publish SITE_ROOT publishes the output with publish.py once the build succeeds.
+- --photos sets where the photos stage writes its manifest (default .build_cache/photo_manifest.json).
+  Without Pillow the stage is skipped with a message, and with --no-photos it is left out; either way
+  the listing pages link the original photos. Photos that could not be downloaded are tried again
+  after a backoff (see photo_cache.py) and give the stage the status "warning".
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import generate_template
+import generic_page
+import listing_list_page
+import listing_pages_generator
+import map_maker
+import photo_cache
+import publish
+import search_index
+import shortcode_cache
+import testimonials
+from template_engine import load_template
+
+DEFAULT_TRACE = os.path.join('.build_cache', 'build_trace.json')
+DEFAULT_PHOTO_MANIFEST = os.path.join('.build_cache', 'photo_manifest.json')
+DEFAULT_WORKERS = 4
+# File systems stamp files with a coarser clock than time.time_ns(), so a file written just after
+# a stage started can look slightly older than the stage
+MTIME_SLACK_NS = 50 * 1000 * 1000
+
+class StageWarning(Exception):
+    """Raised by a stage that did its work but with problems worth reporting. The stage's status is
+    "warning", the stages that depend on it still run and the build does not fail."""
+    def __init__(self, message, files):
+        super().__init__(message)
+        self.files = files
+
+def files_under(directory):
+    return [os.path.join(folder, name) for folder, _, names in os.walk(directory) for name in names]
+
+def master_template_stage(args, context):
+    return [generate_template.fill_master_template(args.template_dir, os.path.join(args.template_dir, 'data.json'))]
+
+def listings_stage(args, context):
+    context.load_listings(args.listings)
+    return []
+
+def photos_stage(args, context):
+    if photo_cache.Image is None:
+        print("Pillow is not installed, so listing photos are not cached; pages link the original photos.")
+        return []
+    _, missing = photo_cache.cache_photos(args.listings, args.output_dir,
+                                          os.path.abspath(photo_cache.DEFAULT_CACHE_DIR), args.photos,
+                                          listings=context.load_listings(args.listings))
+    files = [args.photos] + files_under(os.path.join(args.output_dir, 'photos'))
+    if missing:
+        # The pages link the original of each missing photo
+        raise StageWarning(f"{missing} photos could not be cached", files)
+    return files
+
+def photo_manifest(args):
+    # There is no manifest when the photos stage is left out or has never run with Pillow
+    return args.photos if args.photos and os.path.exists(args.photos) else None
+
+def map_stage(args, context):
+    map_template = load_template(os.path.join(args.template_dir, 'map_template.html'))
+    master_template = load_template(os.path.join(args.template_dir, 'filled_master_template.html'))
+    files = [map_maker.create_html_page(map_template, master_template, args.output_dir)]
+    if os.path.exists(args.map_listings):
+        map_maker.generate_tiles(map_maker.map_points(context.load_listings(args.map_listings)), args.output_dir)
+        files += files_under(os.path.join(args.output_dir, 'tiles'))
+    return files
+
+def testimonials_stage(args, context):
+    return [testimonials.generate_testimonials_page(args.template_dir, args.output_dir)]
+
+def listing_pages_stage(args, context):
+    output_dir = os.path.join(args.output_dir, 'listing')
+    os.makedirs(output_dir, exist_ok=True)
+    return sorted(listing_pages_generator.process_listings(
+        args.template_dir, output_dir, args.listings, photo_manifest=photo_manifest(args),
+        manifest_path=os.path.abspath(listing_pages_generator.DEFAULT_MANIFEST),
+        listings=context.load_listings(args.listings)))
+
+def list_pages_stage(args, context):
+    output_dir = os.path.join(args.output_dir, 'listings')
+    os.makedirs(output_dir, exist_ok=True)
+    return sorted(listing_list_page.generate_list_pages(context.load_listings(args.listings), args.template_dir,
+                                                        output_dir, photo_manifest=photo_manifest(args)))
+
+def search_stage(args, context):
+    search_template = load_template(os.path.join(args.template_dir, 'search_template.html'))
+    master_template = load_template(os.path.join(args.template_dir, 'filled_master_template.html'))
+    files = [search_index.create_html_page(search_template, master_template, args.output_dir)]
+    search_index.build_search_index(context.load_listings(args.listings), args.output_dir)
+    return files + files_under(os.path.join(args.output_dir, search_index.SEARCH_DIR))
+
+def generic_pages_stage(args, context):
+    # The shortcode scripts share the build's parsed files
+    template_context = generic_page.DataContext(args.template_dir, context.files, context.lock)
+    return generic_page.process_files(args.template_dir, args.output_dir,
+                                      os.path.abspath(shortcode_cache.DEFAULT_CACHE), context=template_context,
+                                      manifest_path=os.path.abspath(generic_page.DEFAULT_MANIFEST))
+
+def publish_stage(args, context):
+    release = publish.publish(args.output_dir, args.publish)
+    return files_under(os.path.join(args.publish, publish.RELEASES_DIR, release))
+
+# Each stage with the stages that must finish before it starts
+STAGES = {
+    'master_template': ([], master_template_stage),
+    'listings': ([], listings_stage),
+    'photos': (['listings'], photos_stage),
+    'map': (['master_template'], map_stage),
+    'testimonials': (['master_template'], testimonials_stage),
+    'listing_pages': (['master_template', 'listings', 'photos'], listing_pages_stage),
+    'list_pages': (['master_template', 'listings', 'photos'], list_pages_stage),
+    'search': (['master_template', 'listings'], search_stage),
+    'generic_pages': (['master_template'], generic_pages_stage)
+}
+
+def select_stages(stages, names):
+    """The stages named and every stage they depend on, in the order of stages."""
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in stages:
+            raise KeyError(f"Unknown stage {name}; the stages are {', '.join(stages)}.")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(stages[name][0])
+    return {name: stage for name, stage in stages.items() if name in selected}
+
+def dependent_stages(stages, names):
+    """The stages named and every stage that depends on them, in the order of stages."""
+    for name in names:
+        if name not in stages:
+            raise KeyError(f"Unknown stage {name}; the stages are {', '.join(stages)}.")
+    selected = set(names)
+    # A stage is listed after the stages it depends on, so one pass finds every dependent
+    for name, (depends, _) in stages.items():
+        if any(depend in selected for depend in depends):
+            selected.add(name)
+    return {name: stage for name, stage in stages.items() if name in selected}
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_stage(name, function, args, context, build_start):
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    record = {"stage": name, "start": round(start - build_start, 3), "status": "ok"}
+    files = []
+    try:
+        files = function(args, context) or []
+    except StageWarning as e:
+        record["status"] = "warning"
+        record["warning"] = str(e)
+        files = e.files
+    except Exception as e:
+        traceback.print_exc()
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+
+    written = 0
+    written_bytes = 0
+    for path in files:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime_ns >= start_ns - MTIME_SLACK_NS:
+            written += 1
+            written_bytes += stat.st_size
+    record.update({
+        "wall_time": round(time.perf_counter() - start, 3),
+        "cpu_time": round(time.thread_time() - cpu_start, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "files": len(files),
+        "files_written": written,
+        "bytes_written": written_bytes
+    })
+    return record
+
+def run_build(stages, args, context, workers=DEFAULT_WORKERS, on_record=None):
+    """Run every stage once the stages it depends on succeeded and return their trace records.
+
+    Dependencies that are not among stages are taken as built. on_record, if given, is called
+    with the record of each stage as it finishes.
+    """
+    build_start = time.perf_counter()
+    records = []
+    succeeded = set()
+    failed = set()
+    pending = dict(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while pending or running:
+            for name, (depends, function) in list(pending.items()):
+                if any(depend in failed for depend in depends):
+                    records.append({"stage": name, "status": "skipped"})
+                    failed.add(name)
+                    del pending[name]
+                    if on_record:
+                        on_record(records[-1])
+                elif all(depend in succeeded or depend not in stages for depend in depends):
+                    running[executor.submit(run_stage, name, function, args, context, build_start)] = name
+                    del pending[name]
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                record = future.result()
+                records.append(record)
+                (succeeded if record["status"] in ("ok", "warning") else failed).add(name)
+                if on_record:
+                    on_record(record)
+    return records
+
+def write_trace(records, trace_path, wall_time, workers):
+    trace = {
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "wall_time": round(wall_time, 3),
+        "workers": workers,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": records
+    }
+    os.makedirs(os.path.dirname(trace_path) or '.', exist_ok=True)
+    with open(trace_path, 'w') as file:
+        json.dump(trace, file, indent=2)
+
+def print_summary(records, wall_time):
+    for record in records:
+        if record["status"] == "skipped":
+            print(f"{record['stage']:<16} skipped")
+            continue
+        print(f"{record['stage']:<16} {record['status']:<7} {record['wall_time']:7.2f}s wall {record['cpu_time']:7.2f}s cpu "
+              f"{record['files_written']:6d}/{record['files']:<6d} files {record['bytes_written'] / 1024:9.1f}KB written")
+        if record["status"] == "warning":
+            print(f"{'':<16} {record['warning']}")
+    print(f"Build finished in {wall_time:.2f}s.")
+
+def parse_args(argv=None):
+    """The build options from argv, or from the command line, with every path made absolute."""
+    parser = argparse.ArgumentParser(description='Build the site in one process from a graph of stages.')
+    parser.add_argument('template_dir', help='Directory of the templates, pages and scripts')
+    parser.add_argument('output_dir', help='Directory to save the site')
+    parser.add_argument('--listings', default='mls_data.geojson', help='Listing file for the listing pages and search')
+    parser.add_argument('--map-listings', help='Simplified listing file for the map tiles '
+                                               '(default: mls_data.geojson in the output directory)')
+    parser.add_argument('--photos', default=DEFAULT_PHOTO_MANIFEST,
+                        help='Photo manifest written by the photos stage and read by the listing pages')
+    parser.add_argument('--no-photos', action='store_true',
+                        help='Skip the photos stage and link the original photos, e.g. when offline')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of stages run at a time')
+    parser.add_argument('--stages', nargs='+', metavar='STAGE',
+                        help='Build only these stages and the stages they depend on')
+    parser.add_argument('--from', dest='from_stages', nargs='+', metavar='STAGE',
+                        help='Build only these stages and the stages that depend on them')
+    parser.add_argument('--trace', default=DEFAULT_TRACE, help='Where to write the JSON build trace')
+    parser.add_argument('--publish', metavar='SITE_ROOT', help='Publish the output to SITE_ROOT after the build')
+    args = parser.parse_args(argv)
+
+    # Absolute, so no stage depends on the working directory while shortcode scripts change it
+    args.map_listings = args.map_listings or os.path.join(args.output_dir, 'mls_data.geojson')
+    for name in ('template_dir', 'output_dir', 'listings', 'map_listings', 'photos', 'trace', 'publish'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    try:
+        args.selected = dict(STAGES)
+        if args.stages:
+            args.selected = select_stages(args.selected, args.stages)
+        if args.from_stages:
+            args.selected = dependent_stages(args.selected, args.from_stages)
+    except KeyError as e:
+        parser.error(e.args[0])
+    if args.no_photos:
+        args.selected.pop('photos', None)
+        args.photos = None
+    return args
+
+def main():
+    args = parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    stages = dict(args.selected)
+    if args.publish:
+        stages['publish'] = (list(stages), publish_stage)
+
+    start = time.perf_counter()
+    records = run_build(stages, args, generic_page.DataContext(os.getcwd()), args.workers)
+    wall_time = time.perf_counter() - start
+
+    write_trace(records, args.trace, wall_time, args.workers)
+    print_summary(records, wall_time)
+    if any(record["status"] not in ("ok", "warning") for record in records):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
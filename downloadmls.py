@@ -1,35 +1,202 @@
 import argparse
 import requests
+import hashlib
 import json
+import os
+import random
+import sys
+import threading
 import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse, parse_qs
+from listing_data import save_listings
+from mls_convert import ListingFanOut
+
+API_URL = "https://api.simplyrets.com/properties"
+
+# Query parameter used for each supported way of splitting the feed into shards
+SHARD_PARAMS = {
+    'status': 'status',
+    'postal_code': 'postalCodes',
+    'city': 'cities'
+}
+DEFAULT_STATUS_SHARDS = ['Active', 'ActiveUnderContract', 'Pending', 'ComingSoon']
+# Response header with the number of listings that match a query
+TOTAL_COUNT_HEADER = 'X-Total-Count'
+
+# Query parameter that limits results to listings modified after a timestamp
+MODIFIED_SINCE_PARAM = 'lastModified'
+# Listings reported with one of these statuses are dropped from the local store
+REMOVED_STATUSES = {'Closed', 'Withdrawn', 'Expired', 'Delete', 'Cancelled'}
+
+class MLSFetchError(Exception):
+    def __init__(self, message, last_id=None):
+        super().__init__(message)
+        self.last_id = last_id
+
+
+class RequestScheduler:
+    """Paces requests so the download stays just under the provider's rate limit.
+
+    Concurrency is adjusted AIMD style: every successful response raises the number of requests
+    allowed in flight by a fraction of a slot, and every 429 halves it and pauses all workers for
+    the Retry-After period. Other failures are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, max_concurrency=1, min_concurrency=1, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0}
+
+    @contextmanager
+    def slot(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.concurrency):
+                    break
+                self.condition.wait(timeout=wait if wait > 0 else None)
+            self.in_flight += 1
+            self.stats["requests"] += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def on_success(self, response):
+        with self.condition:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self.condition.notify_all()
+
+        # Slow down before the quota runs out rather than waiting for a 429
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+            self.pause(parse_reset_delay(response.headers.get('X-RateLimit-Reset')) or self.base_delay)
+
+    def on_throttle(self, response, attempt):
+        with self.condition:
+            self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            self.stats["throttled"] += 1
+        delay = parse_retry_after(response.headers.get('Retry-After'))
+        if delay is None:
+            delay = self.backoff_delay(attempt)
+        self.pause(delay)
+        return delay
+
+    def on_retry(self):
+        with self.condition:
+            self.stats["retries"] += 1
+
+    def backoff_delay(self, attempt):
+        # Equal jitter keeps retrying workers from hitting the API in lockstep
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def parse_reset_delay(value):
+    # X-RateLimit-Reset is either seconds until the reset or the reset time as a Unix timestamp
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    if reset > 1e9:
+        reset -= time.time()
+    return max(0.0, reset)
 
 def read_api_credentials(file_path):
     with open(file_path, 'r') as file:
         return file.readline().strip()
 
-def fetch_mls_data(api_key, api_secret, last_id=0, max_retries=3, limit=500):
-    url = f"https://api.simplyrets.com/properties?limit={limit}&lastId={last_id}"
-    retries = 0
+def create_session(api_key, api_secret, pool_size=10, api_url=API_URL):
+    # A shared session keeps connections alive between pages and across worker threads. The
+    # connection pool is sized for the API's host; other hosts get the default pool.
+    session = requests.Session()
+    session.auth = (api_key, api_secret)
+    endpoint = urlparse(api_url)
+    session.mount(f"{endpoint.scheme}://{endpoint.netloc}/",
+                  HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    return session
 
-    while retries < max_retries:
+def fetch_mls_data(api_key, api_secret, last_id=0, max_retries=None, limit=500, session=None, params=None,
+                   scheduler=None, api_url=API_URL):
+    query = {'limit': limit, 'lastId': last_id}
+    if params:
+        query.update(params)
+    requester = session or requests
+    scheduler = scheduler or RequestScheduler()
+    attempts = max_retries or scheduler.max_retries
+
+    for attempt in range(attempts):
+        response = None
         try:
-            response = requests.get(url, auth=(api_key, api_secret))
+            with scheduler.slot():
+                response = requester.get(api_url, params=query, auth=(api_key, api_secret))
             if response.status_code == 200:
+                scheduler.on_success(response)
                 links = response.links
                 next_link = links.get('next', {}).get('url')
                 next_last_id = extract_last_id(next_link) if next_link else None
                 return response.json(), next_last_id
+            if response.status_code == 429:
+                delay = scheduler.on_throttle(response, attempt)
+                print(f"Rate limited at lastId={last_id}. Retrying in {delay:.1f}s...")
+            elif 400 <= response.status_code < 500:
+                # Bad credentials or a bad query fail the same way every time, so they are not retried
+                raise MLSFetchError(f"Request for lastId={last_id} was rejected with status code "
+                                    f"{response.status_code}", last_id=last_id)
             else:
-                print(f"Failed to fetch data, status code: {response.status_code}. Retrying...")
-                retries += 1
-                time.sleep(2)
-        except Exception as e:
-            print(f"An error occurred: {e}. Retrying...")
-            retries += 1
-            time.sleep(2)
+                delay = scheduler.backoff_delay(attempt)
+                print(f"Failed to fetch data, status code: {response.status_code}. Retrying in {delay:.1f}s...")
+        except (requests.RequestException, ValueError) as e:
+            delay = scheduler.backoff_delay(attempt)
+            print(f"An error occurred: {e}. Retrying in {delay:.1f}s...")
+
+        if attempt + 1 < attempts:
+            scheduler.on_retry()
+            time.sleep(delay)
 
-    return None, None
+    raise MLSFetchError(f"Giving up on lastId={last_id} after {attempts} attempts", last_id=last_id)
+
+def count_properties(api_key, api_secret, session=None, params=None, scheduler=None, api_url=API_URL):
+    # One single-listing page is enough to read the count header. Returns None when the count
+    # cannot be read, so a missing header never stops a download.
+    query = {'limit': 1}
+    query.update(params or {})
+    scheduler = scheduler or RequestScheduler()
+    try:
+        with scheduler.slot():
+            response = (session or requests).get(api_url, params=query, auth=(api_key, api_secret))
+    except requests.RequestException:
+        return None
+    total = response.headers.get(TOTAL_COUNT_HEADER, '')
+    return int(total) if response.status_code == 200 and total.isdigit() else None
 
 def extract_last_id(next_link):
     if not next_link:
@@ -83,7 +250,8 @@ def format_property_to_feature(prop):
             "virtualTourUrl": prop.get("virtualTourUrl"),
             "remarks": prop.get("remarks"),
             "salesAgentName": agent_data.get("fullName"),
-            "salesOfficeName": office_data.get("name")
+            "salesOfficeName": office_data.get("name"),
+            "modified": prop.get("modified")
         },
         "geometry": {
             "type": "Point",
@@ -106,29 +274,222 @@ def format_to_geojson(properties):
     return geojson
 
 def save_geojson(geojson, filename):
-    with open(filename, 'w') as file:
-        json.dump(geojson, file, indent=4)
-
-def process_all_properties(api_key, api_secret):
-    all_properties = []
-    last_id = 0
-    limit = 500
+    save_listings(geojson, filename)
 
+def iter_property_pages(api_key, api_secret, session=None, params=None, limit=500, scheduler=None, last_id=0,
+                        api_url=API_URL):
+    # Yields each page with the cursor of the page after it. A page that cannot be fetched raises
+    # MLSFetchError rather than looking like the end of the feed.
     while last_id is not None:
-        properties, next_last_id = fetch_mls_data(api_key, api_secret, last_id=last_id, limit=limit)
-        if properties:
-            all_properties.extend(properties)
-            last_id = next_last_id
-        else:
+        properties, next_last_id = fetch_mls_data(api_key, api_secret, last_id=last_id, limit=limit,
+                                                  session=session, params=params, scheduler=scheduler,
+                                                  api_url=api_url)
+        if not properties:
             break
+        yield properties, next_last_id
+        last_id = next_last_id
+
+def process_all_properties(api_key, api_secret, session=None, params=None, limit=500, scheduler=None,
+                           api_url=API_URL):
+    all_properties = []
+
+    for properties, _ in iter_property_pages(api_key, api_secret, session=session, params=params, limit=limit,
+                                             scheduler=scheduler, api_url=api_url):
+        all_properties.extend(properties)
 
     return all_properties
 
+def load_resume_state(filename, params):
+    state_path = filename + '.resume'
+    if not (os.path.exists(state_path) and os.path.exists(filename + '.tmp')):
+        return None
+    with open(state_path, 'r') as file:
+        state = json.load(file)
+    # A checkpoint taken with different filters belongs to a different download
+    return state if state.get("params") == params else None
+
+def stream_all_properties(api_key, api_secret, filename, session=None, params=None, limit=500, scheduler=None,
+                          resume=False, slim_output=None, demo_output=None, api_url=API_URL):
+    # Each page is converted and written as it arrives, so memory use does not grow with the feed.
+    # The simplified and demo copies made by mls_convert.py can be written in the same pass.
+    # After every page the cursor and file offsets are checkpointed; if the download fails the
+    # partial files are kept so a later run with resume=True can pick up from the last good page.
+    state_path = filename + '.resume'
+    state = load_resume_state(filename, params) if resume else None
+    if state:
+        print(f"Resuming download at lastId={state['last_id']} after {state['count']} listings.")
+
+    with ListingFanOut(filename, slim_output, demo_output, resume_state=state, keep_partial=True) as writer:
+        pages = iter_property_pages(api_key, api_secret, session=session, params=params, limit=limit,
+                                    scheduler=scheduler, last_id=state['last_id'] if state else 0, api_url=api_url)
+        for properties, next_last_id in pages:
+            for prop in properties:
+                writer.write_feature(format_property_to_feature(prop))
+            if next_last_id is not None:
+                save_json_atomic(dict(writer.checkpoint(), last_id=next_last_id, params=params), state_path)
+
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return writer.count
+
+def mls_sort_key(mls_id):
+    # Orders numeric ids numerically while still accepting string ids
+    text = str(mls_id)
+    return (len(text), text)
+
+def build_shards(shard_by, values):
+    param = SHARD_PARAMS[shard_by]
+    return [{param: value} for value in values]
+
+def describe_shard(shard):
+    return ', '.join(f"{key}={value}" for key, value in shard.items())
+
+def fetch_shard(api_key, api_secret, shard, session, limit=500, scheduler=None, api_url=API_URL):
+    start = time.perf_counter()
+    properties = process_all_properties(api_key, api_secret, session=session, params=shard, limit=limit,
+                                        scheduler=scheduler, api_url=api_url)
+    return properties, time.perf_counter() - start
+
+def process_properties_parallel(api_key, api_secret, shards, workers=4, limit=500, scheduler=None,
+                                check_total=False, api_url=API_URL):
+    # With check_total the unsharded feed is counted first, and a warning is printed if the
+    # shards together return fewer listings, e.g. because some listings have a status that no
+    # shard asks for
+    session = create_session(api_key, api_secret, pool_size=workers, api_url=api_url)
+    # All shards share one scheduler, so a 429 on any of them slows the whole download down
+    scheduler = scheduler or RequestScheduler(max_concurrency=workers)
+    expected = (count_properties(api_key, api_secret, session=session, scheduler=scheduler, api_url=api_url)
+                if check_total else None)
+    merged = {}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_shard, api_key, api_secret, shard, session, limit, scheduler, api_url): shard
+            for shard in shards
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            shard = futures[future]
+            properties, elapsed = future.result()
+            # Shards may overlap, so the last copy of a listing wins
+            for prop in properties:
+                merged[prop.get("mlsId")] = prop
+            print(f"[{completed}/{len(shards)}] {describe_shard(shard)}: "
+                  f"{len(properties)} listings in {elapsed:.2f}s")
+
+    print(f"Fetched {len(merged)} unique listings from {len(shards)} shards "
+          f"in {time.perf_counter() - start:.2f}s ({scheduler.stats['requests']} requests, "
+          f"{scheduler.stats['retries']} retries, {scheduler.stats['throttled']} throttled)")
+    if expected is not None and len(merged) < expected:
+        print(f"Warning: the feed has {expected} listings but the shards returned {len(merged)}. "
+              f"{expected - len(merged)} listings are not covered by any shard; list every status with --shards.")
+
+    # Merge in mlsId order so the output does not depend on which shard finished first
+    return [merged[mls_id] for mls_id in sorted(merged, key=mls_sort_key)]
+
+def hash_property(prop):
+    canonical = json.dumps(prop, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def load_store(store_path):
+    if not os.path.exists(store_path):
+        return {"last_sync": None, "listings": {}}
+    with open(store_path, 'r') as file:
+        return json.load(file)
+
+def save_json_atomic(data, filename):
+    temp_path = filename + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(temp_path, filename)
+
+def sync_properties(api_key, api_secret, store_path, full=False, session=None, scheduler=None, api_url=API_URL):
+    store = load_store(store_path)
+    listings = store["listings"]
+    since = None if full else store.get("last_sync")
+    # Stamp the sync before downloading so edits made during the run are picked up next time
+    synced_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    params = {MODIFIED_SINCE_PARAM: since} if since else None
+    fetched = process_all_properties(api_key, api_secret, session=session, params=params, scheduler=scheduler,
+                                     api_url=api_url)
+
+    changes = {"since": since, "synced_at": synced_at, "added": [], "updated": [], "removed": []}
+    seen = set()
+
+    for prop in fetched:
+        mls_id = prop.get("mlsId")
+        key = str(mls_id)
+        seen.add(key)
+
+        if prop.get("mls", {}).get("status") in REMOVED_STATUSES:
+            if listings.pop(key, None) is not None:
+                changes["removed"].append(mls_id)
+            continue
+
+        digest = hash_property(prop)
+        entry = listings.get(key)
+        if entry is None:
+            changes["added"].append(mls_id)
+        elif entry["hash"] != digest:
+            changes["updated"].append(mls_id)
+        else:
+            continue
+
+        listings[key] = {"modified": prop.get("modified"), "hash": digest, "record": prop}
+
+    # A full download lists every live listing, so anything not returned has been removed
+    if since is None:
+        for key in [key for key in listings if key not in seen]:
+            changes["removed"].append(listings.pop(key)["record"].get("mlsId"))
+
+    store["last_sync"] = synced_at
+    save_json_atomic(store, store_path)
+
+    print(f"Sync complete: {len(changes['added'])} added, {len(changes['updated'])} updated, "
+          f"{len(changes['removed'])} removed.")
+    return store, changes
+
+def store_properties(store):
+    listings = store["listings"]
+    return [listings[key]["record"] for key in sorted(listings, key=mls_sort_key)]
+
 def get_args():
     parser = argparse.ArgumentParser(description="Download MLS data and save as GeoJSON.")
     parser.add_argument('--api_key_file', type=str, help='Path to file containing the API key')
     parser.add_argument('--api_secret_file', type=str, help='Path to file containing the API secret')
-    return parser.parse_args()
+    parser.add_argument('--slim-output', type=str,
+                        help='Also write the simplified listing file used by the map (see mls_convert.py)')
+    parser.add_argument('--demo-output', type=str,
+                        help='Also write the simplified listing file with random demo coordinates')
+    parser.add_argument('--api-url', type=str, default=API_URL,
+                        help='Properties endpoint to download from (e.g. a local mock_simplyrets.py server)')
+    parser.add_argument('--output', type=str, default='mls_data.geojson', help='Path of the listing file to write (.geojson or .mlspack)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of shards to download at the same time')
+    parser.add_argument('--shard-by', choices=sorted(SHARD_PARAMS), help='Split the feed into shards by this field')
+    parser.add_argument('--shards', type=str,
+                        help='Comma separated shard values (defaults to common statuses when sharding by status)')
+    parser.add_argument('--sync', action='store_true',
+                        help='Only download listings modified since the last sync and update the local store')
+    parser.add_argument('--full-sync', action='store_true',
+                        help='Download the whole feed and reconcile it against the local store')
+    parser.add_argument('--store', type=str, default='mls_store.json', help='Path to the local listing store')
+    parser.add_argument('--changes', type=str, default='mls_changes.json',
+                        help='Path to write the changeset of added, updated and removed listings '
+                             '(used by listing_pages_generator.py to rebuild only their detail pages)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted download from its last checkpoint '
+                             '(streaming downloads only, not with --sync or sharding)')
+    parser.add_argument('--max-retries', type=int, default=6, help='Attempts per page before giving up')
+    args = parser.parse_args()
+
+    # Only the streaming download writes checkpoints. A failed sync leaves the last sync time
+    # unchanged, so running it again already picks up where it stopped; shards start over.
+    if args.resume and (args.sync or args.full_sync):
+        parser.error("--resume only applies to streaming downloads; run --sync again to retry a failed sync")
+    if args.resume and (args.shard_by or args.workers > 1):
+        parser.error("--resume only applies to streaming downloads; sharded downloads start over")
+    return args
 
 def main():
     args = get_args()
@@ -143,11 +504,52 @@ def main():
     else:
         api_secret = input("Enter your SimplyRETS API secret: ")
 
-    all_properties = process_all_properties(api_key, api_secret)
+    workers = max(1, args.workers)
+    scheduler = RequestScheduler(max_concurrency=workers, max_retries=args.max_retries)
+    sync = args.sync or args.full_sync
+    parallel = not sync and (args.shard_by or workers > 1)
 
-    if all_properties:
+    try:
+        if sync:
+            session = create_session(api_key, api_secret, pool_size=1, api_url=args.api_url)
+            store, changes = sync_properties(api_key, api_secret, args.store, full=args.full_sync, session=session,
+                                             scheduler=scheduler, api_url=args.api_url)
+            save_json_atomic(changes, args.changes)
+            all_properties = store_properties(store)
+        elif parallel:
+            shard_by = args.shard_by or 'status'
+            if args.shards:
+                values = [value.strip() for value in args.shards.split(',') if value.strip()]
+            elif shard_by == 'status':
+                # The default statuses may not cover every listing, so the result is checked
+                # against the unsharded count
+                values = DEFAULT_STATUS_SHARDS
+            else:
+                raise SystemExit(f"--shards is required when sharding by {shard_by}")
+            shards = build_shards(shard_by, values)
+            all_properties = process_properties_parallel(api_key, api_secret, shards, workers=workers,
+                                                         scheduler=scheduler,
+                                                         check_total=not args.shards and shard_by == 'status',
+                                                         api_url=args.api_url)
+        else:
+            session = create_session(api_key, api_secret, pool_size=1, api_url=args.api_url)
+            count = stream_all_properties(api_key, api_secret, args.output, session=session, scheduler=scheduler,
+                                          resume=args.resume, slim_output=args.slim_output,
+                                          demo_output=args.demo_output, api_url=args.api_url)
+    except MLSFetchError as e:
+        print(f"{e}. The existing {args.output} was left unchanged.")
+        if not (sync or parallel):
+            print("Run again with --resume to continue from the last downloaded page.")
+        sys.exit(1)
+
+    if not (sync or parallel):
+        if count:
+            print(f"GeoJSON file saved successfully with {count} listings.")
+        else:
+            print("No data to save.")
+    elif all_properties:
         geojson = format_to_geojson(all_properties)
-        save_geojson(geojson, "mls_data.geojson")
+        save_geojson(geojson, args.output)
         print("GeoJSON file saved successfully.")
     else:
         print("No data to save.")
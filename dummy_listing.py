@@ -39,6 +39,9 @@ def generate_random_company():
     companies = ["Philly Homes", "Liberty Realty", "Brotherly Love Estates", "Independence Properties", "Penn Real Estate"]
     return random.choice(companies)
 
+def generate_random_sub_type():
+    return random.choice(["SingleFamilyResidence", "Townhouse", "Condominium"])
+
 def generate_listing(mls_id):
     images = generate_random_images()
     address = generate_random_address()
@@ -52,6 +55,8 @@ def generate_listing(mls_id):
             "mlsId": mls_id,
             "bathrooms": random.randint(1, 3) + 0.5 * random.randint(0, 1),
             "area": random.randint(500, 3500),
+            "listPrice": random.randrange(50000, 1500000, 1000),
+            "subType": generate_random_sub_type(),
             "featuredImage": images[0] if images else None,
             "otherImages": images[1:] if len(images) > 1 else [],
             "agentName": generate_random_agent(),
@@ -1,11 +1,7 @@
 import json
 import os
-from string import Template
 from datetime import datetime
-
-def load_template(template_path):
-    with open(template_path, 'r') as file:
-        return Template(file.read())
+from template_engine import load_template
 
 def generate_top_bar_content(social_links, phone, email):
     links_html = ''
@@ -45,6 +41,7 @@ def fill_master_template(template_dir, data_file):
         file.write(filled_content)
 
     print("filled_master_template.html has been created successfully.")
+    return output_path
 
 if __name__ == "__main__":
     import argparse
@@ -20,7 +20,27 @@ To embed a Python script directly within an HTML or Markdown file, use the follo
 - `param1`, `param2`, ... are the optional parameters to pass to the script.
 
 Each script must define a `generate_content(params)` function that accepts a dictionary of
-parameters and returns a string containing HTML content.
+parameters and returns a string containing HTML content. A script that defines
+`generate_content(params, context)` also receives the build's data context, which loads each
+data file once per build and shares it with every page:
+
+def generate_content(params, context):
+    data = context.load_json('data.json')
+    listings = context.load_listings('mls_data.geojson')
+
+Data from the context is shared, so scripts must not modify it. Scripts are imported once and
+imported again only when the script file changes.
+
+Shortcode output is cached between builds (see shortcode_cache.py) for scripts that take the
+context or list the files they read in DATA_FILES, and for inline scripts with a "# cache" or
+"# cache: file.json, ..." line. A cached shortcode runs again once its script, its parameters
+or one of its data files changes.
+
+Pages are rebuilt incrementally. Each page records what it depends on in
+.build_cache/generic_pages.json: its source, filled_master_template.html, this script, the
+shortcode scripts it ran and the data files those read (or list in DATA_FILES). A page is only
+rendered again when one of them changes. Pages with inline scripts without a "# cache" line, or
+with shortcode scripts whose data files are not known, are rendered on every build.
 
 Example:
 [script:testimonial number=3]
@@ -30,8 +50,10 @@ This will execute 'testimonial.py' script in the 'scripts' subfolder, passing it
 
 External Scripts:
 Scripts placed in the 'scripts' subfolder can be executed and must also define a 
-`generate_content(params)` function. The current working directory for these scripts
-will be set to the template directory.
+`generate_content(params)` function. Scripts never depend on the working directory of the
+build: a script that takes the context opens its own files with `context.path('file.json')`,
+which gives the path within the template directory. Scripts that only take params still run
+with the template directory as the working directory, but one at a time.
 
 The 'scripts' subfolder can contain any number of scripts, and they will be referenced
 in the content files via shortcodes.
@@ -41,11 +63,14 @@ Requirements:
 - Markdown module (for Markdown files conversion)
 
 To run the script:
-python generic_page_generator.py [TEMPLATE_DIR] [OUTPUT_DIR]
+python generic_page.py [TEMPLATE_DIR] [OUTPUT_DIR] [--workers N] [--no-cache] [--force]
 
 Where:
 - [TEMPLATE_DIR] is the directory containing the 'pages', 'scripts', and master template.
 - [OUTPUT_DIR] is the directory where the generated HTML files will be saved.
+- --workers renders N pages at a time on a thread pool. The pages are the same as with one worker.
+- --no-cache runs every shortcode, without reading or writing the shortcode cache.
+- --force renders every page, even those whose dependencies have not changed.
 """
 """
 Inline Scripts:
@@ -70,9 +95,16 @@ output_html = inline_script()
 # Inline Python script ends here
 python-->
 
-The enclosed Python code will be executed, and the 'output_html' will be injected into the page
+The enclosed Python code will be executed, and what it prints will be injected into the page
 where the script block was placed.
 
+Each block runs in its own namespace, a copy of this module's globals. Everything the block
+writes to stdout or stderr, with `print`, `sys.stdout.write` or from functions in other modules,
+goes to the block's own buffer and into the page. For this the first block replaces sys.stdout
+and sys.stderr with proxies that send the writes of a thread running a block to its buffer and
+all other writes to the console, so pages can be rendered in parallel. An exception raised by the block is not captured;
+it stops the page and is reported on the console.
+
 Note:
 - Inline scripts must not interfere with the structure of the HTML or Markdown.
 - The output must be valid HTML content.
@@ -86,51 +118,177 @@ scripts from trusted sources and ensure that they do not contain harmful code.
 Inline scripts offer a powerful way to inject dynamic content into pages, but they should be used
 responsibly and with a clear understanding of the implications.
 """
+import argparse
 import os
 import markdown
 import json
 import datetime
 import re
-from string import Template
 import importlib.util
+import inspect
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
-import contextlib
+from listing_model import load_listing_records
+from shortcode_cache import DEFAULT_CACHE, ShortcodeCache, file_digest
+from template_engine import load_template
+
+_script_modules = {}
+_script_modules_lock = threading.Lock()
+# Held while a script that does not take the context runs in the template directory
+_working_directory_lock = threading.Lock()
+# "# cache" or "# cache: data.json, testimonials.json" on its own line in an inline script
+CACHE_DIRECTIVE = re.compile(r'^\s*#\s*cache(?::(.*))?\s*$', re.MULTILINE)
+DEFAULT_MANIFEST = os.path.join('.build_cache', 'generic_pages.json')
+# Recorded as a dependency by a script whose data files are not known; its page is rendered on every build
+UNTRACKED = '*'
+_markdown = threading.local()
+# The output buffer of the inline script running on each thread, if any
+_script_output = threading.local()
+_output_streams_lock = threading.Lock()
+
+def read_json(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+class DataContext:
+    """Data files used by the shortcode scripts of one build, parsed once and shared by every page.
+
+    Paths are relative to the template directory. A file is only parsed again if it changes
+    during the build.
+    """
+
+    def __init__(self, template_dir, files=None, lock=None):
+        # Absolute, so paths stay valid while a script runs in another working directory
+        self.template_dir = os.path.abspath(template_dir)
+        self.files = {} if files is None else files
+        # Pages rendered on other threads wait for a file being parsed instead of parsing it again
+        self.lock = lock or threading.Lock()
+        # Paths of the files loaded through this context, which the shortcode cache depends on
+        self.reads = set()
+
+    def fork(self):
+        """A context for one script run, sharing the parsed files and recording what the script reads."""
+        return DataContext(self.template_dir, self.files, self.lock)
+
+    def path(self, relative_path):
+        """Path of a file in the template directory, recorded as read by the script."""
+        path = os.path.join(self.template_dir, relative_path)
+        self.reads.add(path)
+        return path
+
+    def load(self, relative_path, loader):
+        path = self.path(relative_path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        key = (path, loader)
+        with self.lock:
+            cached = self.files.get(key)
+            if cached and cached[0] == version:
+                return cached[1]
+            data = loader(path)
+            self.files[key] = (version, data)
+            return data
+
+    def load_json(self, relative_path):
+        return self.load(relative_path, read_json)
+
+    def load_listings(self, relative_path='mls_data.geojson'):
+        return self.load(relative_path, load_listing_records)
+
+def load_script_module(script_name, script_path):
+    """Import a shortcode script, reusing the module until the script file changes."""
+    stat = os.stat(script_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    key = os.path.abspath(script_path)
+    with _script_modules_lock:
+        cached = _script_modules.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
 
-# Function to execute external script with parameters
-def execute_external_script(script_name, params, template_dir):
-    # Save the current working directory
-    original_cwd = os.getcwd()
-
-    # Change to the template directory
-    os.chdir(template_dir)
+        spec = importlib.util.spec_from_file_location(script_name, script_path)
+        script_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(script_module)
+        _script_modules[key] = (version, script_module)
+        return script_module
 
+def accepts_context(function):
     try:
-        # Create a full path to the script
-        script_path = os.path.join('scripts', script_name + '.py')
+        parameters = inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+    return len(parameters) > 1 or any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters.values())
 
-        if not os.path.isfile(script_path):
-            raise FileNotFoundError(f"Script {script_name} not found in scripts directory.")
+def has_known_inputs(script_module):
+    # Scripts reading through the data context and scripts listing their files in DATA_FILES
+    return hasattr(script_module, 'DATA_FILES') or accepts_context(script_module.generate_content)
 
-        # Load and execute the script as a module
-        spec = importlib.util.spec_from_file_location(script_name, script_path)
-        script_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(script_module)
+def is_cacheable(script_module):
+    # Only scripts whose inputs are known can be cached. CACHE = False opts a script out.
+    return getattr(script_module, 'CACHE', True) and has_known_inputs(script_module)
 
-        # Execute the 'generate_content' function from the script, if it exists
-        if hasattr(script_module, 'generate_content'):
-            result = script_module.generate_content(params)
-        else:
-            raise AttributeError(f"Script {script_name} does not have a 'generate_content' function.")
-    finally:
-        # Change back to the original working directory
-        os.chdir(original_cwd)
+# Function to execute external script with parameters
+def execute_external_script(script_name, params, template_dir, context=None, cache=None, dependencies=None):
+    """Run a shortcode script and return its output.
+
+    dependencies, if given, is a set that collects the script and the data files it read.
+    """
+    context = context or DataContext(template_dir)
+    if dependencies is None:
+        dependencies = set()
+
+    # Create a full path to the script
+    script_path = os.path.join(context.template_dir, 'scripts', script_name + '.py')
+    dependencies.add(script_path)
+
+    if not os.path.isfile(script_path):
+        raise FileNotFoundError(f"Script {script_name} not found in scripts directory.")
+
+    script_module = load_script_module(script_name, script_path)
+
+    # Execute the 'generate_content' function from the script, if it exists
+    if not hasattr(script_module, 'generate_content'):
+        raise AttributeError(f"Script {script_name} does not have a 'generate_content' function.")
+
+    cacheable = cache is not None and is_cacheable(script_module)
+    if cacheable:
+        key = cache.key('script', cache.file_digest(script_path), params)
+        result = cache.lookup(key)
+        if result is not None:
+            dependencies.update(cache.files(key))
+            return result
+
+    script_context = context.fork()
+    if accepts_context(script_module.generate_content):
+        result = script_module.generate_content(params, script_context)
+    else:
+        result = run_in_directory(script_context.template_dir, script_module.generate_content, params)
+
+    declared = [script_context.path(name) for name in getattr(script_module, 'DATA_FILES', [])]
+    if has_known_inputs(script_module):
+        dependencies.update(script_context.reads)
+    else:
+        dependencies.add(UNTRACKED)
+    if cacheable and isinstance(result, str):
+        cache.store(key, result, declared + sorted(script_context.reads))
 
     return result
 
+def run_in_directory(directory, function, *args):
+    # Scripts that only take params may open files relative to the template directory. The
+    # working directory belongs to the whole process, so these scripts run one at a time.
+    with _working_directory_lock:
+        original_cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            return function(*args)
+        finally:
+            os.chdir(original_cwd)
+
 
 # Function to find and process shortcode-like placeholders
-def process_shortcodes(content, template_dir):
+def process_shortcodes(content, template_dir, context=None, cache=None, dependencies=None):
     # Regular expression to find shortcodes
     shortcode_pattern = re.compile(r'\[script:(\w+)(?:\s+([^\]]+))?\]')
     
@@ -147,33 +305,101 @@ def process_shortcodes(content, template_dir):
                 key, value = param.split('=')
                 params_dict[key.strip()] = value.strip()
 
-        return execute_external_script(script_name, params_dict, template_dir)
+        return execute_external_script(script_name, params_dict, template_dir, context, cache, dependencies)
 
     return re.sub(shortcode_pattern, replace_shortcode, content)
 
+class ThreadOutput:
+    """Stands in for sys.stdout or sys.stderr: writes made while an inline script runs on the
+    current thread go to that script's buffer, and all other writes to the wrapped stream."""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def target(self):
+        buffer = getattr(_script_output, 'buffer', None)
+        return self.stream if buffer is None else buffer
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def flush(self):
+        return self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+def install_output_streams():
+    # Done once, or again if something else has replaced the streams since
+    with _output_streams_lock:
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+        if not isinstance(sys.stderr, ThreadOutput):
+            sys.stderr = ThreadOutput(sys.stderr)
+
+def buffer_print(buffer):
+    """A print function that writes to buffer what would have gone to stdout or stderr."""
+    def print_to_buffer(*values, sep=' ', end='\n', file=None, flush=False):
+        if file is None or file in (sys.stdout, sys.stderr, sys.__stdout__, sys.__stderr__):
+            file = buffer
+        print(*values, sep=sep, end=end, file=file, flush=flush)
+    return print_to_buffer
+
 # Function to execute inline Python script
 def execute_inline_script(script_code):
-    # Capture the output of the script
-    with StringIO() as buf, contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
-        # Execute the script in the default global and local scope
-        exec(script_code, globals(), locals())
-        return buf.getvalue()
+    buffer = StringIO()
+    # A copy of the module globals with separate locals, so blocks cannot see or change each
+    # other's names, and a print of its own so the output of other threads is not captured
+    namespace = dict(globals())
+    namespace['print'] = buffer_print(buffer)
+    # Writes to sys.stdout and sys.stderr, including those made by code in other modules, go to
+    # the buffer too, but only from this thread
+    install_output_streams()
+    previous = getattr(_script_output, 'buffer', None)
+    _script_output.buffer = buffer
+    try:
+        exec(script_code, namespace, {})
+    finally:
+        _script_output.buffer = previous
+    return buffer.getvalue()
 
 
 # Function to find and process inline Python scripts
-def process_inline_scripts(content):
+def process_inline_scripts(content, template_dir='.', cache=None, dependencies=None):
     # Regular expression to find inline Python scripts
     inline_script_pattern = re.compile(r'<!--python(.*?)python-->', re.DOTALL)
+    if dependencies is None:
+        dependencies = set()
     
     # Function to replace script block with its output
     def replace_script_block(match):
         script_code = match.group(1)
-        return execute_inline_script(script_code)
+        # Only blocks marked with a "# cache" line have known inputs: the data files it lists
+        directive = CACHE_DIRECTIVE.search(script_code)
+        if not directive:
+            dependencies.add(UNTRACKED)
+            return execute_inline_script(script_code)
+
+        files = [os.path.join(template_dir, name.strip()) for name in (directive.group(1) or '').split(',')
+                 if name.strip()]
+        dependencies.update(files)
+        if cache is None:
+            return execute_inline_script(script_code)
+
+        key = cache.key('inline', script_code)
+        output = cache.lookup(key)
+        if output is None:
+            output = execute_inline_script(script_code)
+            cache.store(key, output, files)
+        return output
 
     return re.sub(inline_script_pattern, replace_script_block, content)
 
 def convert_markdown_to_html(markdown_text):
-    return markdown.markdown(markdown_text)
+    # One converter per thread, reset between pages, instead of a new one with its extensions for every page
+    converter = getattr(_markdown, 'converter', None)
+    if converter is None:
+        converter = _markdown.converter = markdown.Markdown()
+    return converter.reset().convert(markdown_text)
 
 def read_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
@@ -183,44 +409,141 @@ def write_file(file_path, content):
     with open(file_path, 'w', encoding='utf-8') as file:
         file.write(content)
 
-def process_files(template_dir, output_dir):
+def load_page_manifest(manifest_path):
+    if not manifest_path or not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+def save_page_manifest(manifest, manifest_path):
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def dependency_digests(dependencies):
+    """Content hashes of a page's dependencies, or None if the page has inputs that are not known."""
+    if UNTRACKED in dependencies:
+        return None
+    return {path: file_digest(path) for path in sorted(dependencies)}
+
+def render_page(file_name, template_dir, output_dir, master_template, context, cache, previous=None):
+    """Render one file of pages/ into output_dir.
+
+    previous holds the hashes of the page's dependencies from the last build; the page is not
+    rendered again while they are unchanged. Returns the line to report (None for an unchanged
+    page), the path of the page and the hashes of its dependencies for the manifest.
+    """
+    # Skip non-Markdown/HTML files
+    if not file_name.endswith(('.md', '.html')):
+        return None, None, None
+    file_path = os.path.join(template_dir, 'pages', file_name)
+    output_file_name = file_name.replace('.md', '.html') if file_name.endswith('.md') else file_name
+    output_path = os.path.join(output_dir, output_file_name)
+    if previous and os.path.exists(output_path) and all(file_digest(path) == digest
+                                                        for path, digest in previous.items()):
+        return None, output_path, previous
+
+    try:
+        # The page source, the master template and this generator, plus what its scripts use
+        dependencies = {file_path, os.path.join(template_dir, 'filled_master_template.html'), os.path.abspath(__file__)}
+        file_content = read_file(file_path)
+
+        # Process any inline scripts in the content
+        file_content = process_inline_scripts(file_content, template_dir, cache, dependencies)
+
+        # Process any shortcodes in the content
+        file_content = process_shortcodes(file_content, template_dir, context, cache, dependencies)
+
+        # Convert Markdown to HTML if necessary
+        if file_name.endswith('.md'):
+            file_content = convert_markdown_to_html(file_content)
+
+        final_content = master_template.substitute(content=file_content)
+        write_file(output_path, final_content)
+
+        return f"Processed {file_name} into {output_file_name}", output_path, dependency_digests(dependencies)
+    except Exception as e:
+        return f"Error processing {file_name}: {e}", None, None
+
+def process_files(template_dir, output_dir, cache_path=DEFAULT_CACHE, workers=1, context=None,
+                  manifest_path=DEFAULT_MANIFEST, force=False, file_names=None):
+    """Render the pages of template_dir/pages into output_dir and return the paths of every page.
+
+    A page is only rendered again when one of the files it depends on changed since the last
+    build (see the manifest at manifest_path), or for every page with force. context, if given,
+    is a DataContext for template_dir whose parsed files are reused. file_names limits the build
+    to those pages; a named page that no longer exists is removed from output_dir.
+    """
+    # Absolute, so no page depends on the working directory while scripts change it
+    template_dir = os.path.abspath(template_dir)
+    output_dir = os.path.abspath(output_dir)
     pages_dir = os.path.join(template_dir, 'pages')
     master_template_path = os.path.join(template_dir, 'filled_master_template.html')
-    master_template_content = read_file(master_template_path)
-    master_template = Template(master_template_content)
-
-    for file_name in os.listdir(pages_dir):
-        try:
-            file_path = os.path.join(pages_dir, file_name)
-            file_content = read_file(file_path)
-
-            # Process any inline scripts in the content
-            file_content = process_inline_scripts(file_content)
-
-            # Process any shortcodes in the content
-            file_content = process_shortcodes(file_content, template_dir)
-
-            # Convert Markdown to HTML if necessary
-            if file_name.endswith('.md'):
-                file_content = convert_markdown_to_html(file_content)
-                output_file_name = file_name.replace('.md', '.html')
-            elif file_name.endswith('.html'):
-                output_file_name = file_name
-            else:
-                continue  # Skip non-Markdown/HTML files
-
-            final_content = master_template.substitute(content=file_content)
-            output_path = os.path.join(output_dir, output_file_name)
-            write_file(output_path, final_content)
-
-            print(f"Processed {file_name} into {output_file_name}")
-        except Exception as e:
-            print(f"Error processing {file_name}: {e}")
+    master_template = load_template(master_template_path, encoding='utf-8')
+    context = context or DataContext(template_dir)
+    cache = ShortcodeCache(cache_path) if cache_path else None
+    manifest = load_page_manifest(manifest_path)
+    known = manifest.get(output_dir, {})
+    previous = {} if force else known
+
+    def render(file_name):
+        return render_page(file_name, template_dir, output_dir, master_template, context, cache,
+                           previous.get(file_name))
+
+    # The other pages keep their manifest entries
+    kept = {}
+    if file_names is None:
+        file_names = os.listdir(pages_dir)
+    else:
+        kept = {file_name: digests for file_name, digests in known.items() if file_name not in file_names}
+        for file_name in file_names:
+            if not os.path.exists(os.path.join(pages_dir, file_name)):
+                output_path = os.path.join(output_dir, file_name.replace('.md', '.html'))
+                if file_name.endswith(('.md', '.html')) and os.path.isfile(output_path):
+                    os.remove(output_path)
+                    print(f"Deleted removed page: {output_path}")
+        file_names = [file_name for file_name in file_names if os.path.exists(os.path.join(pages_dir, file_name))]
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map keeps the order of the pages, so the report reads the same as a serial build
+            results = list(executor.map(render, file_names))
+    else:
+        results = map(render, file_names)
+    pages = {}
+    unchanged = 0
+    for file_name, (message, output_path, digests) in zip(file_names, results):
+        if message:
+            print(message)
+        elif output_path:
+            unchanged += 1
+        if output_path:
+            pages[file_name] = (output_path, digests)
+
+    # Pages with inputs that are not all known are left out, so they are rendered every time
+    if manifest_path:
+        manifest[output_dir] = dict(kept, **{file_name: digests for file_name, (_, digests) in pages.items()
+                                             if digests})
+        save_page_manifest(manifest, manifest_path)
+
+    print(f"{len(pages) - unchanged} pages rendered, {unchanged} unchanged.")
+    if cache:
+        cache.save()
+        print(cache.stats())
+    return [output_path for output_path, _ in pages.values()]
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the pages of a template with the master template.')
+    parser.add_argument('template_dir', help='Directory with pages/, scripts/ and filled_master_template.html')
+    parser.add_argument('output_dir', help='Directory to save the generated pages')
+    parser.add_argument('--workers', type=int, default=1, help='Number of pages to render at a time')
+    parser.add_argument('--no-cache', action='store_true', help='Run every shortcode without the shortcode cache')
+    parser.add_argument('--force', action='store_true', help='Render every page, even unchanged ones')
+    args = parser.parse_args()
+
+    process_files(args.template_dir, args.output_dir, None if args.no_cache else DEFAULT_CACHE, args.workers,
+                  force=args.force)
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("Usage: python generic_page_generator.py [TEMPLATE_DIR] [OUTPUT_DIR]")
-    else:
-        template_dir = sys.argv[1]
-        output_dir = sys.argv[2]
-        process_files(template_dir, output_dir)
+    main()
@@ -1,14 +1,30 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 import os
 import json
 from werkzeug.utils import secure_filename
+from build import STAGES
+from rebuild_worker import RebuildWorker
 
 app = Flask(__name__)
-TEMPLATES_DIR = 'template'
+# Absolute, as shortcode scripts may change the working directory while a rebuild runs
+BASE_DIR = os.getcwd()
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'template')
 PAGES_DIR = os.path.join(TEMPLATES_DIR, 'pages')
 BLOG_DIR = os.path.join(TEMPLATES_DIR, 'blog')
 SCRIPTS_DIR = os.path.join(TEMPLATES_DIR, 'scripts')
 DATA_FILE = os.path.join(TEMPLATES_DIR, 'data.json')
+OUTPUT_DIR = os.path.join(BASE_DIR, 'dummyweb')
+# Seconds between keep-alive comments on /rebuild/events
+EVENTS_KEEPALIVE = 15
+
+rebuild_worker = RebuildWorker(TEMPLATES_DIR, OUTPUT_DIR)
+
+def queue_rebuild(response, pages=(), stages=()):
+    # Edits answer at once; the rebuild runs in the background and is reported at /rebuild/jobs/<id>
+    job = rebuild_worker.queue(pages, stages)
+    body = response.get_json()
+    body["rebuild"] = job["id"]
+    return jsonify(body)
 
 def read_json_file(file_path):
     with open(file_path, 'r') as file:
@@ -42,7 +58,8 @@ def site_data():
         return jsonify(read_json_file(DATA_FILE))
     elif request.method == 'PUT':
         write_json_file(DATA_FILE, request.json)
-        return jsonify({"message": "Data updated successfully"})
+        # Every page carries the master template filled from data.json
+        return queue_rebuild(jsonify({"message": "Data updated successfully"}), stages=['master_template'])
 
 @app.route('/pages', methods=['GET', 'POST'])
 @app.route('/pages/<filename>', methods=['GET', 'PUT', 'DELETE'])
@@ -70,7 +87,7 @@ def custom_pages(filename=None):
             return jsonify({"error": "File already exists"}), 409
         with open(file_path, 'w') as file:
             file.write(file_info.get('content', ''))  # Create a new file with optional content
-        return jsonify({"message": "File created successfully"})
+        return queue_rebuild(jsonify({"message": "File created successfully"}), pages=[os.path.basename(file_path)])
     elif request.method == 'PUT':
         # Update an existing file
         if filename:
@@ -79,7 +96,8 @@ def custom_pages(filename=None):
             if os.path.exists(file_path):
                 with open(file_path, 'w') as file:
                     file.write(content)
-                return jsonify({"message": "File updated successfully"})
+                return queue_rebuild(jsonify({"message": "File updated successfully"}),
+                                     pages=[os.path.basename(file_path)])
             else:
                 return jsonify({"error": "File not found"}), 404
         else:
@@ -90,7 +108,8 @@ def custom_pages(filename=None):
             file_path = os.path.join(PAGES_DIR, secure_filename(filename))
             if os.path.exists(file_path):
                 os.remove(file_path)
-                return jsonify({"message": "File deleted successfully"})
+                return queue_rebuild(jsonify({"message": "File deleted successfully"}),
+                                     pages=[os.path.basename(file_path)])
             else:
                 return jsonify({"error": "File not found"}), 404
         else:
@@ -136,7 +155,8 @@ def custom_shortcodes(filename=None):
             if os.path.exists(file_path):
                 with open(file_path, 'w') as file:
                     file.write(content)
-                return jsonify({"message": "File updated successfully"})
+                # Only the pages that use the script are rendered again
+                return queue_rebuild(jsonify({"message": "File updated successfully"}), stages=['generic_pages'])
             else:
                 return jsonify({"error": "File not found"}), 404
         else:
@@ -147,7 +167,7 @@ def custom_shortcodes(filename=None):
             file_path = os.path.join(SCRIPTS_DIR, secure_filename(filename))
             if os.path.exists(file_path):
                 os.remove(file_path)
-                return jsonify({"message": "File deleted successfully"})
+                return queue_rebuild(jsonify({"message": "File deleted successfully"}), stages=['generic_pages'])
             else:
                 return jsonify({"error": "File not found"}), 404
         else:
@@ -177,7 +197,8 @@ def templates(filepath=None):
         else:
             return jsonify(os.listdir(TEMPLATES_DIR))
     elif request.method == 'PUT':
-        return file_operation(TEMPLATES_DIR, filepath, 'PUT', request.data.decode('utf-8'))
+        return queue_rebuild(file_operation(TEMPLATES_DIR, filepath, 'PUT', request.data.decode('utf-8')),
+                             stages=['master_template'])
     elif request.method == 'DELETE':
         return file_operation(TEMPLATES_DIR, filepath, 'DELETE')
 
@@ -194,13 +215,55 @@ def create_page():
     with open(file_path, 'w') as file:
         file.write('')  # Create an empty file
 
-    return jsonify({"message": "File created successfully"})
+    return queue_rebuild(jsonify({"message": "File created successfully"}), pages=[os.path.basename(file_path)])
+
+@app.route('/rebuild', methods=['POST'])
+def rebuild():
+    # Rebuild the given stages and their dependents, or the whole site
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    stages = body.get('stages')
+    if stages is None or stages == []:
+        stages = list(STAGES)
+    if not isinstance(stages, list) or not all(isinstance(stage, str) for stage in stages):
+        return jsonify({"error": "stages must be a list of stage names"}), 400
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        return jsonify({"error": f"Unknown stages: {', '.join(unknown)}"}), 400
+    return queue_rebuild(jsonify({"message": "Rebuild queued"}), stages=stages)
+
+@app.route('/rebuild/jobs', methods=['GET'])
+@app.route('/rebuild/jobs/<int:job_id>', methods=['GET'])
+def rebuild_jobs(job_id=None):
+    if job_id is None:
+        return jsonify(rebuild_worker.get_jobs())
+    job = rebuild_worker.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/rebuild/events', methods=['GET'])
+def rebuild_events():
+    # Server-sent events: every change to a job is sent as one "data:" line of JSON
+    def stream():
+        since = 0
+        while True:
+            for job in rebuild_worker.get_jobs(since):
+                since = max(since, job["version"])
+                yield f"data: {json.dumps(job)}\n\n"
+            if rebuild_worker.wait_for_change(since, EVENTS_KEEPALIVE) == since:
+                yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
 
 
 
 @app.route('/')
 def load_editor():
-    return send_from_directory(os.getcwd(), 'editor.html')
+    return send_from_directory(BASE_DIR, 'editor.html')
 
 if __name__ == '__main__':
     app.run(debug=True)
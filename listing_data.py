@@ -0,0 +1,190 @@
+"""
+Listing Data Loader
+
+Reads and writes the listing data shared by the page generators. Two formats are supported:
+
+- GeoJSON (`.geojson` / `.json`), the format produced by downloadmls.py and mls_convert.py.
+- A compact binary format (`.mlspack`): an 8 byte magic header followed by one record per
+  feature, where each record is a 4 byte big-endian length and the msgpack encoding of the
+  feature. Records can be read one at a time, so large files never have to be held in memory.
+
+The format is picked from the file extension, so every stage can call `load_listings()` or
+`open_listing_writer()` without caring which one it was given.
+
+To convert between formats:
+python listing_data.py mls_data.geojson mls_data.mlspack
+python listing_data.py mls_data.mlspack mls_data.geojson
+
+The compact format needs the msgpack module (pip install msgpack).
+"""
+import argparse
+import json
+import os
+import struct
+from textwrap import indent
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPACT_EXTENSION = '.mlspack'
+COMPACT_MAGIC = b'MLSPACK1'
+RECORD_LENGTH = struct.Struct('>I')
+
+def is_compact(path):
+    return path.endswith(COMPACT_EXTENSION)
+
+def require_msgpack():
+    if msgpack is None:
+        raise ImportError(f"The msgpack module is required to read or write {COMPACT_EXTENSION} files "
+                          "(pip install msgpack).")
+
+def iter_compact_features(path):
+    require_msgpack()
+    with open(path, 'rb') as file:
+        if file.read(len(COMPACT_MAGIC)) != COMPACT_MAGIC:
+            raise ValueError(f"{path} is not a {COMPACT_EXTENSION} file")
+        while True:
+            header = file.read(RECORD_LENGTH.size)
+            if not header:
+                break
+            (length,) = RECORD_LENGTH.unpack(header)
+            yield msgpack.unpackb(file.read(length))
+
+def load_compact(path):
+    require_msgpack()
+    with open(path, 'rb') as file:
+        data = memoryview(file.read())
+
+    if data[:len(COMPACT_MAGIC)] != COMPACT_MAGIC:
+        raise ValueError(f"{path} is not a {COMPACT_EXTENSION} file")
+
+    features = []
+    offset = len(COMPACT_MAGIC)
+    while offset < len(data):
+        (length,) = RECORD_LENGTH.unpack_from(data, offset)
+        offset += RECORD_LENGTH.size
+        features.append(msgpack.unpackb(data[offset:offset + length]))
+        offset += length
+
+    return {"type": "FeatureCollection", "features": features}
+
+def load_listings(path):
+    """Load a FeatureCollection from either a GeoJSON or a compact listing file."""
+    if is_compact(path):
+        return load_compact(path)
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def iter_features(path):
+    """Yield the features of a listing file one at a time."""
+    if is_compact(path):
+        yield from iter_compact_features(path)
+    else:
+        yield from load_listings(path)["features"]
+
+
+class GeoJSONStreamWriter:
+    """Writes a FeatureCollection one feature at a time.
+
+    The output is written to a temporary file next to the destination and only renamed over it once
+    the collection is complete, so an interrupted run never replaces a good file. The layout
+    matches json.dump(geojson, file, indent=4).
+
+    With keep_partial the temporary file is left behind on failure. Passing the last value of
+    checkpoint() back as resume_state reopens it and continues after the last checkpointed feature.
+    """
+    mode = ''
+
+    def __init__(self, filename, allow_empty=False, resume_state=None, keep_partial=False):
+        self.filename = filename
+        self.temp_path = filename + '.tmp'
+        self.allow_empty = allow_empty
+        self.resume_state = resume_state
+        self.keep_partial = keep_partial
+        self.count = 0
+        self.file = None
+
+    def __enter__(self):
+        if self.resume_state:
+            # Anything written after the checkpoint belongs to a page that did not finish
+            self.file = open(self.temp_path, 'r+' + self.mode)
+            self.file.seek(self.resume_state["offset"])
+            self.file.truncate()
+            self.count = self.resume_state["count"]
+        else:
+            self.file = open(self.temp_path, 'w' + self.mode)
+            self.start()
+        return self
+
+    def start(self):
+        self.file.write('{\n    "type": "FeatureCollection",\n    "features": [')
+
+    def checkpoint(self):
+        self.file.flush()
+        return {"offset": self.file.tell(), "count": self.count}
+
+    def write_feature(self, feature):
+        separator = ',\n' if self.count else '\n'
+        self.file.write(separator + indent(json.dumps(feature, indent=4), ' ' * 8))
+        self.count += 1
+
+    def finish(self):
+        self.file.write('\n    ]\n}' if self.count else ']\n}')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and (self.count or self.allow_empty):
+            self.finish()
+            self.file.close()
+            os.replace(self.temp_path, self.filename)
+        else:
+            self.file.close()
+            if exc_type is None or not self.keep_partial:
+                os.remove(self.temp_path)
+        return False
+
+
+class CompactStreamWriter(GeoJSONStreamWriter):
+    """Writes features to a compact listing file, with the same atomic rename as GeoJSONStreamWriter."""
+    mode = 'b'
+
+    def __enter__(self):
+        require_msgpack()
+        return super().__enter__()
+
+    def start(self):
+        self.file.write(COMPACT_MAGIC)
+
+    def write_feature(self, feature):
+        record = msgpack.packb(feature)
+        self.file.write(RECORD_LENGTH.pack(len(record)))
+        self.file.write(record)
+        self.count += 1
+
+    def finish(self):
+        pass
+
+def open_listing_writer(path, allow_empty=False, resume_state=None, keep_partial=False):
+    writer_class = CompactStreamWriter if is_compact(path) else GeoJSONStreamWriter
+    return writer_class(path, allow_empty=allow_empty, resume_state=resume_state, keep_partial=keep_partial)
+
+def save_listings(geojson, path):
+    with open_listing_writer(path, allow_empty=True) as writer:
+        for feature in geojson["features"]:
+            writer.write_feature(feature)
+
+def convert_listings(input_path, output_path):
+    with open_listing_writer(output_path, allow_empty=True) as writer:
+        for feature in iter_features(input_path):
+            writer.write_feature(feature)
+    return writer.count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert listing data between GeoJSON and the compact format.')
+    parser.add_argument('input_file', help='Listing file to read (.geojson or .mlspack)')
+    parser.add_argument('output_file', help='Listing file to write (.geojson or .mlspack)')
+    args = parser.parse_args()
+
+    count = convert_listings(args.input_file, args.output_file)
+    print(f"Converted {count} listings from {args.input_file} to {args.output_file}.")
@@ -1,38 +1,135 @@
-import json
 import argparse
+import json
 import os
-from string import Template
+import re
+from collections import OrderedDict
+from html import escape
+from listing_model import load_listing_records, parse_number, template_values
+from photo_cache import image_attributes, load_photo_manifest
+from template_engine import load_template
 
 LISTINGS_PER_PAGE = 20
-
-def load_template(template_path):
-    with open(template_path, 'r') as file:
-        return Template(file.read())
-
-def sort_listings(listings, sort_key=None, reverse=False):
-    if sort_key:
-        def parse_price(price):
-            if isinstance(price, str):
-                # Remove dollar sign and commas before converting to float
-                return float(price.replace('$', '').replace(',', ''))
-            elif isinstance(price, (int, float)):
-                return float(price)
-            else:
-                return 0.0
-
-        return sorted(listings, key=lambda x: parse_price(x['properties'].get(sort_key, 0)), reverse=reverse)
-    return listings
-
-
-def generate_pagination_links(current_page, total_pages, version_name):
+# Rendered cards kept for reuse by the next views; a card pushed out is rendered again if needed
+CARD_CACHE_SIZE = 5000
+VIEWS_FILE = 'listing_views.json'
+
+# The views built when the template directory has no listing_views.json
+DEFAULT_VIEWS = [
+    {"name": "Most_Recent", "label": "Most Recent", "index": True},
+    {"name": "Highest_Price_First", "label": "Highest Price First", "sort": "listPrice", "reverse": True},
+    {"name": "Lowest_Price_First", "label": "Lowest Price First", "sort": "listPrice"}
+]
+
+def load_views(views_file):
+    if not views_file or not os.path.exists(views_file):
+        return DEFAULT_VIEWS
+    with open(views_file, 'r') as file:
+        return json.load(file)["views"]
+
+def sort_column(listings, sort_key):
+    """One sort value per listing, all numbers or all text, so the sort never compares the two.
+
+    Listings without a value get None.
+    """
+    values = [listing.value(sort_key) for listing in listings]
+    # A column sorts as numbers when every value present is one, e.g. "3" and 3 from different feeds
+    if all(parse_number(value) is not None for value in values if value not in (None, '')):
+        return list(map(parse_number, values))
+    return [None if value in (None, '') else str(value) for value in values]
+
+def sort_order(column, reverse=False):
+    """Return the listing numbers in sorted order; the listings themselves are never reordered.
+
+    Listings without a value come last in either direction, so a view such as Lowest Price per
+    Sqft does not start with the listings that have no price or area.
+    """
+    present = [number for number, value in enumerate(column) if value is not None]
+    missing = [number for number, value in enumerate(column) if value is None]
+    return sorted(present, key=column.__getitem__, reverse=reverse) + missing
+
+def facet_groups(listings, order, facet):
+    """Split a sort order into one order per value of the facet, keeping the sort within each group."""
+    groups = {}
+    for number in order:
+        value = listings[number].value(facet)
+        if value not in (None, ''):
+            groups.setdefault(str(value), []).append(number)
+    return dict(sorted(groups.items()))
+
+def page_slug(value):
+    return re.sub(r'[^A-Za-z0-9]+', '_', value).strip('_') or 'Other'
+
+def view_label(view):
+    return view.get("label", view["name"].replace('_', ' '))
+
+def first_page_name(view):
+    if view.get("index"):
+        return 'index.html'
+    if view.get("facet"):
+        return f'{view["name"]}.html'
+    return f'{view["name"]}_page_1.html'
+
+def navigation_links(views):
+    links = [f'<a href="{first_page_name(view)}">{view_label(view)}</a>' for view in views]
+    return '<div class="listing-navigation"> ' + ' | '.join(links) + '</div>'
+
+def render_card(listing, listing_template, photos):
+    flattened_props = template_values(listing)
+
+    # Serve the cached, responsive copy of the photo when there is one
+    photo = photos.get(flattened_props.get('featuredImage'))
+    if photo:
+        flattened_props['featuredImage'] = photo['variants'][-1]['jpg']
+        flattened_props['featuredImageAttributes'] = image_attributes(photo)
+    else:
+        flattened_props['featuredImageAttributes'] = ''
+
+    return listing_template.safe_substitute(flattened_props) + '\n'
+
+class CardCache:
+    """The cards of the listings, rendered when a page first needs them.
+
+    Only the max_size most recently used cards are kept, so memory does not grow with the number
+    of listings. Feeds up to max_size listings render every card once, as if all of them were kept.
+    """
+    def __init__(self, listings, listing_template, photos, max_size=CARD_CACHE_SIZE):
+        self.listings = listings
+        self.listing_template = listing_template
+        self.photos = photos
+        self.max_size = max_size
+        self.cards = OrderedDict()
+        self.rendered = 0
+
+    def __getitem__(self, number):
+        card = self.cards.get(number)
+        if card is None:
+            card = render_card(self.listings[number], self.listing_template, self.photos)
+            self.rendered += 1
+            self.cards[number] = card
+            if len(self.cards) > self.max_size:
+                self.cards.popitem(last=False)
+        else:
+            self.cards.move_to_end(number)
+        return card
+
+def page_file_name(version_name, page, index_page=False):
+    # The first page of the index view is served as index.html
+    return 'index.html' if page == 1 and index_page else f'{version_name}_page_{page}.html'
+
+def generate_pagination_links(current_page, total_pages, version_name, index_page=False):
     links = []
 
     # Define how many page links to show around the current page
     num_links_around_current = 2
 
-    for page in range(1, total_pages + 1):
-        # Adjust URL for first page of "Most Recent"
-        page_link = 'index.html' if page == 1 and version_name == 'Most_Recent' else f'{version_name}_page_{page}.html'
+    # Only the first and last pages, the window around the current page and the pages where the
+    # ellipses go can produce output, so visit just those instead of every page of the view
+    window = range(max(2, current_page - num_links_around_current - 1),
+                   min(total_pages - 1, current_page + num_links_around_current + 1) + 1)
+    pages = [1, *window, total_pages] if total_pages > 1 else [1]
+
+    for page in pages:
+        page_link = page_file_name(version_name, page, index_page)
 
         # Always show the first and last pages
         if page == 1 or page == total_pages:
@@ -46,14 +143,14 @@ def generate_pagination_links(current_page, total_pages, version_name):
                 links.append(f'<a href="{page_link}">{page}</a>')
 
         # Show ellipses when there is a gap
-        elif page == current_page - num_links_around_current - 1 or page == current_page + num_links_around_current + 1:
+        else:
             links.append('...')
 
     # "Previous" and "Next" buttons
     prev_page = max(1, current_page - 1)
     next_page = min(total_pages, current_page + 1)
 
-    prev_page_link = 'index.html' if prev_page == 1 and version_name == 'Most_Recent' else f'{version_name}_page_{prev_page}.html'
+    prev_page_link = page_file_name(version_name, prev_page, index_page)
     next_page_link = f'{version_name}_page_{next_page}.html'
 
     prev_link = f'<a href="{prev_page_link}">&laquo; Previous</a>' if current_page > 1 else ''
@@ -61,86 +158,117 @@ def generate_pagination_links(current_page, total_pages, version_name):
 
     return prev_link + ' ' + ' '.join(links) + ' ' + next_link
 
-def generate_paginated_html(listings, listing_template, master_template, output_dir, version_name, generated_files):
-    total_pages = (len(listings) + LISTINGS_PER_PAGE - 1) // LISTINGS_PER_PAGE
+def generate_paginated_html(cards, order, master_template, output_dir, version_name, generated_files,
+                            navigation, index_page=False, title_name=None):
+    """Write the pages of one view, joining the cards in the view's order."""
+    title_name = title_name or version_name.replace('_', ' ')
+    total_pages = (len(order) + LISTINGS_PER_PAGE - 1) // LISTINGS_PER_PAGE
 
     for page in range(1, total_pages + 1):
-        page_listings = listings[(page - 1) * LISTINGS_PER_PAGE : page * LISTINGS_PER_PAGE]
-
-        content = ''
-        content += '<div class="listing-navigation"> <a href="index.html">Most Recent</a> | <a href="Highest_Price_First_page_1.html">Highest Price First</a> | <a href="Lowest_Price_First_page_1.html">Lowest Price First</a></div>'
-        for listing in page_listings:
-            # Flatten the properties
-            flattened_props = listing['properties']
-            flattened_props['fullAddressPrettyPrinted'] = flattened_props['fullAddress']['prettyPrinted']
-            
-            # Formatting listPrice
-            if 'listPrice' in flattened_props:
-                try:
-                    list_price = float(flattened_props['listPrice'])
-                    flattened_props['listPrice'] = f"${list_price:,.0f}"
-                except ValueError:
-                    flattened_props['listPrice'] = flattened_props['listPrice']
-            else:
-                flattened_props['listPrice'] = "N/A"
-
-            # Handle missing data
-            flattened_props = {k: v if v is not None else '' for k, v in flattened_props.items()}
-
-            content += listing_template.safe_substitute(flattened_props) + '\n'
+        page_order = order[(page - 1) * LISTINGS_PER_PAGE : page * LISTINGS_PER_PAGE]
+        content = navigation + ''.join(cards[number] for number in page_order)
 
         # Generate pagination links for each page
-        pagination_links = generate_pagination_links(page, total_pages, version_name)
+        pagination_links = generate_pagination_links(page, total_pages, version_name, index_page)
 
         page_content = f"<div class='listing-table'>{content}</div><nav class='pagination'>{pagination_links}</nav>"
 
         # Generate a dynamic title for each page
-        title = f"{version_name.replace('_', ' ')} Listings - Page {page}"
+        title = f"{title_name} Listings - Page {page}"
 
         # Substitute content and title in master template
         final_content = master_template.safe_substitute(content=page_content, title=title)
 
-        # Determine file name
-        file_name = 'index.html' if page == 1 and version_name == 'Most_Recent' else f'{version_name}_page_{page}.html'
-        file_path = os.path.join(output_dir, file_name)
+        file_path = os.path.join(output_dir, page_file_name(version_name, page, index_page))
         generated_files.add(file_path)
 
         with open(file_path, 'w') as file:
             file.write(final_content)
 
+def generate_facet_index(groups, prefixes, master_template, output_dir, view, generated_files, navigation):
+    """Write the page linking to the listings of every value of a facet view."""
+    items = ''.join(f'<li><a href="{prefixes[value]}_page_1.html">{escape(value)}</a> ({len(order)})</li>'
+                    for value, order in groups.items())
+    page_content = f"<div class='listing-table'>{navigation}<ul class='listing-facets'>{items}</ul></div>"
+    final_content = master_template.safe_substitute(content=page_content, title=f"{view_label(view)} Listings")
+
+    file_path = os.path.join(output_dir, first_page_name(view))
+    generated_files.add(file_path)
+    with open(file_path, 'w') as file:
+        file.write(final_content)
+
+def generate_views(listings, views, listing_template, master_template, output_dir, photos=None,
+                   card_cache_size=CARD_CACHE_SIZE):
+    """Write the pages of every view and return the paths written.
+
+    Every sort order is computed once, and cards are rendered when a page needs them and kept in
+    a bounded cache (see CardCache), so a view mostly costs joining cards already rendered while
+    memory stays bounded however many listings there are.
+    """
+    photos = photos or {}
+    cards = CardCache(listings, listing_template, photos, card_cache_size)
+    navigation = navigation_links(views)
+    orders = {}
+    generated_files = set()
+
+    for view in views:
+        key = (view.get("sort"), bool(view.get("reverse")))
+        if key not in orders:
+            if key[0]:
+                orders[key] = sort_order(sort_column(listings, key[0]), key[1])
+            else:
+                orders[key] = list(range(len(listings)))
+        order = orders[key]
+
+        if not view.get("facet"):
+            generate_paginated_html(cards, order, master_template, output_dir, view["name"], generated_files,
+                                    navigation, view.get("index", False), view.get("label"))
+            continue
+
+        groups = facet_groups(listings, order, view["facet"])
+        prefixes = {}
+        for value in groups:
+            prefix = f'{view["name"]}_{page_slug(value)}'
+            # Values that only differ in punctuation would share a slug
+            while prefix in prefixes.values():
+                prefix += '_'
+            prefixes[value] = prefix
+        for value, group_order in groups.items():
+            generate_paginated_html(cards, group_order, master_template, output_dir, prefixes[value],
+                                    generated_files, navigation, title_name=value)
+        generate_facet_index(groups, prefixes, master_template, output_dir, view, generated_files, navigation)
+
+    return generated_files
+
+
+def generate_list_pages(listings, template_dir, output_dir, views_file=None, photo_manifest=None):
+    """Generate every view of listings into output_dir, delete obsolete pages and return the pages written."""
+    views = load_views(views_file or os.path.join(template_dir, VIEWS_FILE))
+
+    listing_template = load_template(os.path.join(template_dir, 'listing_template.html'))
+    master_template = load_template(os.path.join(template_dir, 'filled_master_template.html'))
+
+    photos = load_photo_manifest(photo_manifest)
+    generated_files = generate_views(listings, views, listing_template, master_template, output_dir, photos)
+
+    # Delete pages of views or facet values that no longer exist
+    for file_name in os.listdir(output_dir):
+        file_path = os.path.join(output_dir, file_name)
+        if file_name.endswith('.html') and os.path.isfile(file_path) and file_path not in generated_files:
+            os.remove(file_path)
+    return generated_files
 
 def main():
     parser = argparse.ArgumentParser(description='Generate Paginated Listing Pages.')
     parser.add_argument('template_dir', help='Directory of HTML templates')
     parser.add_argument('output_dir', help='Directory for output HTML files')
     parser.add_argument('json_file', help='JSON file with listings')
+    parser.add_argument('--photos', help='Photo manifest from photo_cache.py, for responsive cached images')
+    parser.add_argument('--views', help=f'View definitions (default: {VIEWS_FILE} in the template directory)')
     args = parser.parse_args()
 
-    with open(args.json_file, 'r') as file:
-        data = json.load(file)
-        listings = data['features']  # Extract listings from features key
-
-    listing_template = load_template(os.path.join(args.template_dir, 'listing_template.html'))
-    master_template = load_template(os.path.join(args.template_dir, 'filled_master_template.html'))
-
-    generated_files = set()
-
-    # Generate "Most Recent" pages without sorting
-    generate_paginated_html(listings, listing_template, master_template, args.output_dir, 'Most_Recent', generated_files)
-
-    # Generate "Highest Price First" pages
-    sorted_listings = sort_listings(listings, 'listPrice', True)
-    generate_paginated_html(sorted_listings, listing_template, master_template, args.output_dir, 'Highest_Price_First', generated_files)
-
-    # Generate "Lowest Price First" pages
-    sorted_listings = sort_listings(listings, 'listPrice', False)
-    generate_paginated_html(sorted_listings, listing_template, master_template, args.output_dir, 'Lowest_Price_First', generated_files)
-
-    # Delete obsolete files
-    existing_files = set(os.listdir(args.output_dir))
-    for file_path in existing_files - generated_files:
-        if os.path.isfile(file_path):
-            os.remove(file_path)
+    generate_list_pages(load_listing_records(args.json_file), args.template_dir, args.output_dir, args.views,
+                        args.photos)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,155 @@
+"""
+Listing Model
+
+The in-memory listing record shared by the generators and shortcode scripts. Each listing is
+parsed once per build from the GeoJSON (or .mlspack) feature:
+
+- The fields the generators sort, filter and cluster on are typed columns on a `__slots__`
+  record: `list_price`, `bedrooms`, `bathrooms`, `area`, `longitude`, `latitude`. Numbers that
+  arrive as strings such as "$1,234" are parsed here, once, and missing values are None.
+- The original properties are kept as they are and never modified, so one view formatting a
+  listing cannot change what the next view sorts on. They are kept whole because the listing
+  pages, the list cards and the map tiles output nearly every property.
+- The feature wrapper and its Point geometry are not kept: `listing.feature` rebuilds them from
+  the properties and the typed coordinates, which saves about a fifth of the memory of the
+  parsed features. A feature that would not come back the same, such as one with other members
+  or another kind of geometry, is kept as it was.
+- Display formatting (prices, the values handed to templates) lives in the functions at the
+  bottom of this module and always returns new values.
+
+Usage:
+from listing_model import load_listing_records, format_price
+
+listings = load_listing_records('mls_data.geojson')
+cheapest = min(listings, key=lambda listing: listing.list_price or 0)
+print(format_price(cheapest.list_price))
+"""
+from listing_data import iter_features
+
+# Property names of the typed columns, as they appear in the GeoJSON
+NUMERIC_FIELDS = {
+    'listPrice': 'list_price',
+    'bedrooms': 'bedrooms',
+    'bathrooms': 'bathrooms',
+    'area': 'area'
+}
+
+# Values computed from other fields, which views can sort and group on like stored properties
+DERIVED_FIELDS = {
+    'pricePerSqft': lambda listing: listing.list_price / listing.area if listing.list_price and listing.area else None,
+    'city': lambda listing: listing.city
+}
+
+def parse_number(value):
+    """Return value as an int or float, or None if it is missing or not a number."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        text = value.replace('$', '').replace(',', '').strip()
+        try:
+            return int(text)
+        except ValueError:
+            try:
+                return float(text)
+            except ValueError:
+                return None
+    return None
+
+
+def is_plain_point(feature, longitude, latitude):
+    """True if feature is exactly what Listing.feature rebuilds from its properties and coordinates."""
+    if list(feature) != ['type', 'properties', 'geometry'] or feature["type"] != "Feature":
+        return False
+    geometry = feature["geometry"]
+    if not isinstance(geometry, dict) or list(geometry) != ['type', 'coordinates'] or geometry["type"] != "Point":
+        return False
+    coordinates = geometry["coordinates"]
+    return (isinstance(coordinates, list) and len(coordinates) == 2 and
+            all(value is None or type(value) in (int, float) for value in coordinates) and
+            coordinates[0] == longitude and coordinates[1] == latitude)
+
+
+class Listing:
+    __slots__ = ('_properties', '_feature', 'mls_id', 'list_price', 'bedrooms', 'bathrooms', 'area', 'longitude',
+                 'latitude')
+
+    def __init__(self, feature):
+        properties = feature["properties"]
+        self._properties = properties
+        self.mls_id = properties.get("mlsId")
+        self.list_price = parse_number(properties.get("listPrice"))
+        self.bedrooms = parse_number(properties.get("bedrooms"))
+        self.bathrooms = parse_number(properties.get("bathrooms"))
+        self.area = parse_number(properties.get("area"))
+        coordinates = (feature.get("geometry") or {}).get("coordinates") or [None, None]
+        self.longitude = parse_number(coordinates[0])
+        self.latitude = parse_number(coordinates[1])
+        self._feature = None if is_plain_point(feature, self.longitude, self.latitude) else feature
+
+    @property
+    def properties(self):
+        return self._properties
+
+    @property
+    def feature(self):
+        """The listing as a GeoJSON feature, equal to the one it was parsed from."""
+        if self._feature is not None:
+            return self._feature
+        return {"type": "Feature", "properties": self._properties,
+                "geometry": {"type": "Point", "coordinates": [self.longitude, self.latitude]}}
+
+    @property
+    def sub_type(self):
+        return self.properties.get("subType")
+
+    @property
+    def address(self):
+        # Full listings carry the address parts, simplified ones only the printed address
+        full_address = self.properties.get("fullAddress")
+        if isinstance(full_address, dict):
+            return full_address.get("prettyPrinted")
+        return full_address
+
+    @property
+    def city(self):
+        full_address = self.properties.get("fullAddress")
+        return full_address.get("city") if isinstance(full_address, dict) else None
+
+    @property
+    def photo(self):
+        return self.properties.get("featuredImage") or self.properties.get("listingPhoto")
+
+    @property
+    def images(self):
+        return [self.photo] + (self.properties.get("otherImages") or [])
+
+    def value(self, field):
+        """The typed value of a property, e.g. listing.value('listPrice').
+
+        Numeric and derived fields come from the typed columns, any other property is returned as stored.
+        """
+        if field in NUMERIC_FIELDS:
+            return getattr(self, NUMERIC_FIELDS[field])
+        if field in DERIVED_FIELDS:
+            return DERIVED_FIELDS[field](self)
+        return self.properties.get(field)
+
+def load_listing_records(path):
+    return [Listing(feature) for feature in iter_features(path)]
+
+def format_price(price, missing="N/A"):
+    return f"${price:,.0f}" if price is not None else missing
+
+def template_values(listing):
+    """A new mapping of the listing's properties for listing_template.html.
+
+    Missing values become empty strings, the price is formatted for display and the printed
+    address is available as fullAddressPrettyPrinted.
+    """
+    values = {key: value if value is not None else '' for key, value in listing.properties.items()}
+    values['fullAddressPrettyPrinted'] = listing.address
+    # A price that is not a number is shown as it was given
+    values['listPrice'] = format_price(listing.list_price, listing.properties.get('listPrice') or "N/A")
+    return values
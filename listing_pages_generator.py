@@ -1,15 +1,29 @@
-from string import Template
 import json
 import argparse
+import hashlib
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
+from listing_model import format_price, load_listing_records
+from photo_cache import load_photo_manifest, picture_html
+from template_engine import load_template
 
-def load_template(template_path):
-    with open(template_path, 'r') as file:
-        return Template(file.read())
+# Listings are handed to worker processes in chunks, so each task is worth the cost of sending it
+CHUNK_SIZE = 250
+TEMPLATE_NAMES = ['listing_content_template.html', 'filled_master_template.html', 'mls-attribution.html']
+DEFAULT_MANIFEST = os.path.join('.build_cache', 'listing_pages.json')
 
-def generate_image_gallery(images):
-    return '\n'.join([f'<img src="{img}" alt="Image of property">' for img in images])
+def generate_image_gallery(images, photos=None):
+    photos = photos or {}
+    tags = []
+    for index, img in enumerate(images):
+        if img in photos:
+            # Only the first image is visible when the page loads, so the rest can load lazily
+            tags.append(picture_html(photos[img], 'Image of property', lazy=index > 0))
+        else:
+            tags.append(f'<img src="{img}" alt="Image of property">')
+    return '\n'.join(tags)
 
 def generate_features_section(features):
     section_html = ''
@@ -20,8 +34,23 @@ def generate_features_section(features):
         section_html += '</div>\n'
     return section_html
 
-def create_html_page(feature, template_dir, destination_folder):
-    properties = feature["properties"]
+def listing_page_path(destination_folder, mls_id):
+    return f"{destination_folder}/listing_{mls_id}.html"
+
+def last_updated_date(properties, first_seen=None):
+    # The listing's own modification time keeps the page stable between builds. The feed does not
+    # always have one, so the time the build manifest first saw the listing's current content is
+    # used next, and the build date only when there is no manifest.
+    modified = properties.get("modified") or first_seen
+    if modified:
+        try:
+            return datetime.fromisoformat(modified.replace('Z', '+00:00')).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return datetime.now().strftime("%Y-%m-%d")  # Format: YYYY-MM-DD
+
+def create_html_page(listing, template_dir, destination_folder, photos=None, first_seen=None):
+    properties = listing.properties
     
     # Load content and master templates
     content_template_path = os.path.join(template_dir, 'listing_content_template.html')
@@ -32,7 +61,7 @@ def create_html_page(feature, template_dir, destination_folder):
     mls_attribution_template = load_template(mls_attribution_template_path)
     
     # Prepare image gallery HTML
-    image_gallery_html = generate_image_gallery([properties["featuredImage"]] + properties["otherImages"])
+    image_gallery_html = generate_image_gallery(listing.images, photos)
     
     # Prepare features sections HTML
     interior_features = {
@@ -53,7 +82,7 @@ def create_html_page(feature, template_dir, destination_folder):
         'Lot Size': str(properties.get("lotSize"))
         }
     financial_features = {
-        'List Price': f'${properties.get("listPrice"):,.0f}' if properties.get("listPrice") else None,
+        'List Price': format_price(listing.list_price) if listing.list_price else None,
         'Sub Type': properties.get("subType"),
         'Subdivision': properties.get("subdivision"),
         'Parking': properties.get("parking")
@@ -67,16 +96,15 @@ def create_html_page(feature, template_dir, destination_folder):
     remarks = properties.get("remarks")
 
     # Load MLS attribution content
-    last_updated_date = datetime.now().strftime("%Y-%m-%d")  # Format: YYYY-MM-DD
     mls_attribution_content = mls_attribution_template.safe_substitute({
-        'last_updated_date': last_updated_date 
+        'last_updated_date': last_updated_date(properties, first_seen)
     })
 
     # Substitute variables in content template
     content_filled = content_template.safe_substitute({
         'remarks': remarks,
-        'address': properties["fullAddress"]["prettyPrinted"],
-        'listPrice': f'${properties.get("listPrice"):,.0f}' if properties.get("listPrice") else "N/A",
+        'address': listing.address,
+        'listPrice': format_price(listing.list_price) if listing.list_price else "N/A",
         'image_gallery': image_gallery_html,
         'interior_features': interior_features_html,
         'exterior_features': exterior_features_html,
@@ -91,22 +119,198 @@ def create_html_page(feature, template_dir, destination_folder):
     })
 
     # Write to file
-    filename = f"{destination_folder}/listing_{properties['mlsId']}.html"
+    filename = listing_page_path(destination_folder, listing.mls_id)
     with open(filename, 'w') as file:
         file.write(final_html_content)
     
     return filename  # Return the path of the created/updated file
 
 
-def process_listings(template_dir, output_dir, json_file):
-    with open(json_file, 'r') as file:
-        geojson = json.load(file)
+# Set in each worker process by init_worker
+worker_state = {}
+
+def init_worker(template_dir, photos):
+    # Compile the templates once per worker instead of once per chunk
+    for name in TEMPLATE_NAMES:
+        load_template(os.path.join(template_dir, name))
+    worker_state["template_dir"] = template_dir
+    worker_state["photos"] = photos
+
+def render_chunk(listings, destination_folder, dates):
+    return [create_html_page(listing, worker_state["template_dir"], destination_folder, worker_state["photos"],
+                             dates.get(str(listing.mls_id)))
+            for listing in listings]
+
+def render_pages(listings, template_dir, destination_folder, photos=None, workers=1, dates=None):
+    """Render a page for every listing and return the set of files written.
 
+    dates maps an mls_id to the time its content was first seen, for listings without a
+    modification time. With more than one worker the listings are split into chunks and rendered
+    in a process pool; the pages are the same as when they are rendered one after another.
+    """
+    dates = dates or {}
+    if workers <= 1:
+        return {create_html_page(listing, template_dir, destination_folder, photos, dates.get(str(listing.mls_id)))
+                for listing in listings}
+
+    chunks = [listings[start:start + CHUNK_SIZE] for start in range(0, len(listings), CHUNK_SIZE)]
+    # Each chunk only carries the dates of its own listings
+    chunk_dates = [{str(listing.mls_id): dates[str(listing.mls_id)] for listing in chunk
+                    if str(listing.mls_id) in dates} for chunk in chunks]
     created_files = set()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(template_dir, photos)) as executor:
+        for chunk_files in executor.map(render_chunk, chunks, repeat(destination_folder), chunk_dates):
+            created_files.update(chunk_files)
+    return created_files
+
+
+def inputs_digest(template_dir):
+    """Hash of everything besides the listing that shapes its page: the templates and this script."""
+    digest = hashlib.sha256()
+    for name in TEMPLATE_NAMES:
+        digest.update(load_template(os.path.join(template_dir, name)).digest.encode('utf-8'))
+    with open(__file__, 'rb') as file:
+        digest.update(file.read())
+    return digest.hexdigest()
+
+def listing_digest(listing, shared_digest, photos=None):
+    listing_photos = [(photos or {}).get(image) for image in listing.images]
+    payload = json.dumps([shared_digest, listing.feature, listing_photos], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def content_digest(listing):
+    return hashlib.sha256(json.dumps(listing.feature, sort_keys=True).encode('utf-8')).hexdigest()
+
+def update_first_seen(first_seen, listings):
+    """Record when each listing's content was first seen and return those times by mls_id.
+
+    first_seen maps an mls_id to the digest of the listing's feature and the time that digest
+    first appeared. A listing whose content changed gets the current time.
+    """
+    now = datetime.now().isoformat(timespec='seconds')
+    dates = {}
+    for listing in listings:
+        mls_id = str(listing.mls_id)
+        digest = content_digest(listing)
+        if first_seen.get(mls_id, [None])[0] != digest:
+            first_seen[mls_id] = [digest, now]
+        dates[mls_id] = first_seen[mls_id][1]
+    return dates
+
+def load_page_manifest(manifest_path):
+    if not manifest_path or not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+def save_page_manifest(manifest, manifest_path):
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def render_changed_pages(listings, template_dir, destination_folder, photos=None, workers=1,
+                         manifest_path=DEFAULT_MANIFEST, force=False):
+    """Render the pages whose inputs changed since the last build and return every page path.
+
+    The manifest stores a hash of each listing's inputs (its feature, its cached photos, the
+    templates and this script) per output folder. A page is skipped when its hash matches and the
+    file is still there. It also stores when each listing's content was first seen, which is
+    the "last updated" date of listings without a modification time.
+    """
+    manifest = load_page_manifest(manifest_path)
+    folder_key = os.path.abspath(destination_folder)
+    folder = manifest.get(folder_key, {})
+    previous = {} if force else folder.get("pages", {})
+    first_seen = folder.get("first_seen", {})
+    dates = update_first_seen(first_seen, listings)
+    shared_digest = inputs_digest(template_dir)
+
+    pages = {}
+    unchanged_files = set()
+    changed_listings = []
+    for listing in listings:
+        mls_id = str(listing.mls_id)
+        pages[mls_id] = listing_digest(listing, shared_digest, photos)
+        filename = listing_page_path(destination_folder, mls_id)
+        if previous.get(mls_id) == pages[mls_id] and os.path.exists(filename):
+            unchanged_files.add(filename)
+        else:
+            changed_listings.append(listing)
+
+    created_files = render_pages(changed_listings, template_dir, destination_folder, photos, workers, dates)
+    if manifest_path:
+        manifest[folder_key] = {"pages": pages,
+                                "first_seen": {mls_id: first_seen[mls_id] for mls_id in pages}}
+        save_page_manifest(manifest, manifest_path)
+
+    print(f"Rendered {len(changed_listings)} listing pages, {len(unchanged_files)} unchanged.")
+    return created_files | unchanged_files
+
+
+def load_changes(changes_file):
+    with open(changes_file, 'r') as file:
+        changes = json.load(file)
+    changed_ids = {str(mls_id) for mls_id in changes.get("added", []) + changes.get("updated", [])}
+    removed_ids = {str(mls_id) for mls_id in changes.get("removed", [])}
+    return changed_ids, removed_ids
+
+
+def process_changed_listings(template_dir, output_dir, listings, changes_file, photos=None, workers=1,
+                             manifest_path=DEFAULT_MANIFEST):
+    """Render the pages of the listings added or updated in a changeset and delete the removed ones.
+
+    The changeset only covers the listing detail pages. The list pages, the search index and the
+    map tiles are built from the whole listing file, since one changed price or removed listing can
+    move every listing after it, so they are still rebuilt in full by their own scripts.
+    """
+    changed_ids, removed_ids = load_changes(changes_file)
+
+    changed_listings = [listing for listing in listings if str(listing.mls_id) in changed_ids]
+    manifest = load_page_manifest(manifest_path)
+    folder = manifest.setdefault(os.path.abspath(output_dir), {})
+    first_seen = folder.setdefault("first_seen", {})
+    dates = update_first_seen(first_seen, changed_listings)
+    render_pages(changed_listings, template_dir, output_dir, photos, workers, dates)
+
+    # Keep the manifest in step, so the next full build does not render these pages again
+    if manifest_path:
+        pages = folder.setdefault("pages", {})
+        shared_digest = inputs_digest(template_dir)
+        for listing in changed_listings:
+            pages[str(listing.mls_id)] = listing_digest(listing, shared_digest, photos)
+        for mls_id in removed_ids:
+            pages.pop(mls_id, None)
+            first_seen.pop(mls_id, None)
+        save_page_manifest(manifest, manifest_path)
+
+    for mls_id in removed_ids:
+        file_path = os.path.join(output_dir, f"listing_{mls_id}.html")
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+            print(f"Deleted removed listing: {file_path}")
+
+    print(f"Rendered {len(changed_ids)} changed listings, removed {len(removed_ids)}.")
+
+
+def process_listings(template_dir, output_dir, json_file, changes_file=None, photo_manifest=None, workers=1,
+                     manifest_path=DEFAULT_MANIFEST, force=False, listings=None):
+    """Render the listing pages into output_dir and return the paths of the current pages.
+
+    listings, if given, are the records already parsed from json_file.
+    """
+    if listings is None:
+        listings = load_listing_records(json_file)
+    photos = load_photo_manifest(photo_manifest)
+
+    # A changeset from a delta sync limits the work to the listings that changed
+    if changes_file:
+        process_changed_listings(template_dir, output_dir, listings, changes_file, photos, workers, manifest_path)
+        return set()
 
-    for feature in geojson["features"]:
-        created_file = create_html_page(feature, template_dir, output_dir)
-        created_files.add(created_file)
+    created_files = render_changed_pages(listings, template_dir, output_dir, photos, workers,
+                                         manifest_path, force)
 
     # Compare with full paths of existing files
     existing_files = {os.path.join(output_dir, f) for f in os.listdir(output_dir)}
@@ -116,6 +320,7 @@ def process_listings(template_dir, output_dir, json_file):
         if os.path.isfile(file_path):
             os.remove(file_path)
             print(f"Deleted stale file: {file_path}")
+    return created_files
 
 
 def main():
@@ -123,12 +328,19 @@ def main():
     parser.add_argument('template_dir', help='Directory of the HTML templates')
     parser.add_argument('output_dir', help='Directory to save the generated HTML files')
     parser.add_argument('json_file', help='Path to the JSON file containing listings')
+    parser.add_argument('--changes', help='Changeset file from downloadmls.py --sync; only the pages of changed listings are rebuilt')
+    parser.add_argument('--photos', help='Photo manifest from photo_cache.py, for responsive cached images')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes used to render the pages')
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST,
+                        help='Build manifest used to skip listings whose inputs have not changed')
+    parser.add_argument('--force', action='store_true', help='Render every listing page, even unchanged ones')
     args = parser.parse_args()
 
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
-    process_listings(args.template_dir, args.output_dir, args.json_file)
+    process_listings(args.template_dir, args.output_dir, args.json_file, args.changes, args.photos, args.workers,
+                     args.manifest, args.force)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
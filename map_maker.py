@@ -1,12 +1,29 @@
 import json
 import argparse
+import math
 import os
+import shutil
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
 from datetime import datetime
-from string import Template
+from listing_model import load_listing_records
+from template_engine import load_template
 
-def load_template(template_path):
-    with open(template_path, 'r') as file:
-        return Template(file.read())
+# A tile is split into four children until it holds at most this many listings
+MAX_TILE_FEATURES = 256
+MAX_TILE_ZOOM = 18
+MAX_LATITUDE = 85.0511287798
+# Clusters are precomputed on a grid of 64px cells (4 per 256px map tile). Levels stop at
+# CLUSTER_MAX_ZOOM, or earlier once a level would hold more than CLUSTER_MIN_REDUCTION of the listings
+CLUSTER_CELLS_PER_TILE_SHIFT = 2
+CLUSTER_MAX_ZOOM = 16
+CLUSTER_MIN_REDUCTION = 0.5
+# Facet indexes answer the map filters without scanning every listing
+NUMERIC_FACETS = ['listPrice', 'bedrooms', 'bathrooms']
+CATEGORY_FACET = 'subType'
+GRID_CELL_LISTINGS = 16
+MAX_GRID_SIZE = 256
 
 def create_html_page(map_template, master_template, destination_folder):
     # Load and prepare the map page content
@@ -22,11 +39,321 @@ def create_html_page(map_template, master_template, destination_folder):
     file_path = os.path.join(destination_folder, "map.html")
     with open(file_path, 'w') as file:
         file.write(html_content)
+    return file_path
+
+def tile_fraction(lng, lat):
+    """Position of a point in the Web Mercator square, as fractions of its width and height."""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = (lng + 180.0) / 360.0
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0
+    return min(max(x, 0.0), 1.0 - 1e-12), min(max(y, 0.0), 1.0 - 1e-12)
+
+def split_tile(points, z, x, y, max_features, max_zoom, leaves):
+    # points holds (x fraction, y fraction, feature) tuples that fall inside tile z/x/y
+    if len(points) <= max_features or z >= max_zoom:
+        leaves.append((z, x, y, points))
+        return
+
+    children = {}
+    scale = 2 ** (z + 1)
+    for point in points:
+        child = (int(point[0] * scale), int(point[1] * scale))
+        children.setdefault(child, []).append(point)
+
+    for (child_x, child_y), child_points in sorted(children.items()):
+        split_tile(child_points, z + 1, child_x, child_y, max_features, max_zoom, leaves)
+
+def load_map_points(listings_file):
+    return map_points(load_listing_records(listings_file))
+
+def map_points(listings):
+    """Return (x fraction, y fraction, listing) for every listing that has coordinates."""
+    points = []
+    for listing in listings:
+        if listing.longitude is None or listing.latitude is None:
+            continue
+        x, y = tile_fraction(listing.longitude, listing.latitude)
+        points.append((x, y, listing))
+    return points
+
+def generate_tiles(points, output_dir, max_features=MAX_TILE_FEATURES, max_zoom=MAX_TILE_ZOOM,
+                   cluster_max_zoom=CLUSTER_MAX_ZOOM):
+    """Cut the listings into a quadtree of small static tiles under output_dir/tiles.
+
+    Dense areas are split into deeper, smaller tiles so no tile holds more than max_features
+    listings. tiles/index.json lists every tile with its listing count, which lets the map page
+    fetch only the tiles that cover the current view, the highest zoom level that has
+    precomputed clusters (see generate_clusters) and the facet indexes (see generate_facets).
+    """
+    west, south, east, north = 180.0, 90.0, -180.0, -90.0
+    for point in points:
+        lng, lat = point[2].longitude, point[2].latitude
+        west, south, east, north = min(west, lng), min(south, lat), max(east, lng), max(north, lat)
+
+    leaves = []
+    if points:
+        split_tile(points, 0, 0, 0, max_features, max_zoom, leaves)
+
+    # Tiles from a previous build may no longer exist in the new pyramid
+    tiles_dir = os.path.join(output_dir, 'tiles')
+    if os.path.exists(tiles_dir):
+        shutil.rmtree(tiles_dir)
+
+    for z, x, y, tile_points in leaves:
+        tile_path = os.path.join(tiles_dir, str(z), str(x), f"{y}.json")
+        os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+        with open(tile_path, 'w') as file:
+            json.dump({"type": "FeatureCollection", "features": [point[2].feature for point in tile_points]},
+                      file, separators=(',', ':'))
+
+    index = {
+        "count": len(points),
+        "bounds": [west, south, east, north] if points else None,
+        "clusterZoom": generate_clusters(points, tiles_dir, cluster_max_zoom),
+        "facets": generate_facets([point[2] for leaf in leaves for point in leaf[3]], tiles_dir),
+        "tiles": [[z, x, y, len(tile_points)] for z, x, y, tile_points in leaves]
+    }
+    os.makedirs(tiles_dir, exist_ok=True)
+    with open(os.path.join(tiles_dir, 'index.json'), 'w') as file:
+        json.dump(index, file, separators=(',', ':'))
+
+    print(f"Wrote {len(leaves)} map tiles for {len(points)} listings.")
+    return index
+
+def merge_cluster(target, source):
+    # A cluster is [count, sum of lng, sum of lat, west, south, east, north, min price, max price]
+    target[0] += source[0]
+    target[1] += source[1]
+    target[2] += source[2]
+    target[3], target[4] = min(target[3], source[3]), min(target[4], source[4])
+    target[5], target[6] = max(target[5], source[5]), max(target[6], source[6])
+    if source[7] is not None:
+        target[7] = source[7] if target[7] is None else min(target[7], source[7])
+        target[8] = source[8] if target[8] is None else max(target[8], source[8])
+
+def cluster_record(cluster):
+    count, sum_lng, sum_lat, west, south, east, north, min_price, max_price = cluster
+    record = [round(sum_lng / count, 6), round(sum_lat / count, 6), count, min_price, max_price]
+    if count > 1:
+        record += [round(west, 6), round(south, 6), round(east, 6), round(north, 6)]
+    return record
+
+def generate_clusters(points, tiles_dir, max_zoom=CLUSTER_MAX_ZOOM):
+    """Precompute the marker clusters of each zoom level into tiles_dir/clusters/<zoom>.json.
+
+    Listings are bucketed into grid cells at max_zoom, and each coarser level is built by merging
+    four cells of the level below, so the whole pyramid costs one pass over the listings. Each
+    cluster is stored as [lng, lat, count, min price, max price] followed by [west, south, east,
+    north] when it holds more than one listing; the lng/lat is the centroid of its listings.
+
+    Returns the highest zoom level written, or None when there is nothing to cluster.
+    """
+    if not points:
+        return None
+
+    cells = {}
+    scale = 2 ** (max_zoom + CLUSTER_CELLS_PER_TILE_SHIFT)
+    for x, y, listing in points:
+        lng, lat, price = listing.longitude, listing.latitude, listing.list_price
+        cell = (int(x * scale), int(y * scale))
+        cluster = [1, lng, lat, lng, lat, lng, lat, price, price]
+        if cell in cells:
+            merge_cluster(cells[cell], cluster)
+        else:
+            cells[cell] = cluster
+
+    levels = [cells]
+    for _ in range(max_zoom):
+        parents = {}
+        for (cell_x, cell_y), cluster in levels[-1].items():
+            parent = (cell_x >> 1, cell_y >> 1)
+            if parent in parents:
+                merge_cluster(parents[parent], cluster)
+            else:
+                parents[parent] = list(cluster)
+        levels.append(parents)
+    levels.reverse()
+
+    # Once a level barely merges any listings the map is better off showing the listings themselves
+    cluster_zoom = None
+    for zoom, level in enumerate(levels):
+        if len(level) > len(points) * CLUSTER_MIN_REDUCTION:
+            break
+        cluster_zoom = zoom
+
+    if cluster_zoom is None:
+        return None
+
+    clusters_dir = os.path.join(tiles_dir, 'clusters')
+    os.makedirs(clusters_dir, exist_ok=True)
+    for zoom, level in enumerate(levels[:cluster_zoom + 1]):
+        with open(os.path.join(clusters_dir, f"{zoom}.json"), 'w') as file:
+            json.dump([cluster_record(cluster) for _, cluster in sorted(level.items())], file,
+                      separators=(',', ':'))
+
+    print(f"Wrote map clusters for zoom levels 0-{cluster_zoom}.")
+    return cluster_zoom
+
+def write_typed_array(file, typecode, values):
+    # The map page reads these with JavaScript typed arrays, which use little-endian byte order
+    data = array(typecode, values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    data.tofile(file)
+
+def generate_facets(listings, tiles_dir):
+    """Write the filter indexes of the map page into tiles_dir/facets as typed-array files.
+
+    Listings are numbered in tile order: the listings of tiles[0] in index.json come first, then
+    those of tiles[1], and so on, so a listing number points straight at the tile that holds it.
+
+    - <facet>.bin for listPrice, bedrooms and bathrooms: the sorted values (Float64) followed by the
+      listing numbers in the same order (Uint32). A minimum or maximum filter is one binary search.
+      Listings without a value are left out.
+    - subType.bin: the listing numbers (Uint32) grouped by subtype, with the start of each group
+      in the metadata.
+    - grid.bin: a grid over the listing bounds. The start offset of each cell (Uint32, one more than
+      there are cells), then the listing numbers cell by cell (Uint32), then their [lng, lat]
+      positions in the same order (Float64, starting at the next multiple of 8 bytes).
+
+    Returns the metadata that goes into tiles/index.json.
+    """
+    facets_dir = os.path.join(tiles_dir, 'facets')
+    os.makedirs(facets_dir, exist_ok=True)
+    meta = {"count": len(listings), "numeric": {}}
+
+    for name in NUMERIC_FACETS:
+        entries = sorted((listing.value(name), number) for number, listing in enumerate(listings)
+                         if listing.value(name) is not None)
+        with open(os.path.join(facets_dir, f"{name}.bin"), 'wb') as file:
+            write_typed_array(file, 'd', [value for value, _ in entries])
+            write_typed_array(file, 'I', [number for _, number in entries])
+        meta["numeric"][name] = len(entries)
+
+    groups = {}
+    for number, listing in enumerate(listings):
+        groups.setdefault(listing.sub_type or '', []).append(number)
+    values = sorted(groups)
+    offsets = [0]
+    with open(os.path.join(facets_dir, f"{CATEGORY_FACET}.bin"), 'wb') as file:
+        for value in values:
+            write_typed_array(file, 'I', groups[value])
+            offsets.append(offsets[-1] + len(groups[value]))
+    meta["category"] = {"name": CATEGORY_FACET, "values": values, "offsets": offsets}
+
+    positions = [(listing.longitude, listing.latitude) for listing in listings]
+    size = max(1, min(MAX_GRID_SIZE, math.ceil(math.sqrt(len(listings) / GRID_CELL_LISTINGS))))
+    west = min((lng for lng, _ in positions), default=0.0)
+    south = min((lat for _, lat in positions), default=0.0)
+    east = max((lng for lng, _ in positions), default=0.0)
+    north = max((lat for _, lat in positions), default=0.0)
+    cells = [[] for _ in range(size * size)]
+    for number, (lng, lat) in enumerate(positions):
+        column = min(int((lng - west) / ((east - west) or 1) * size), size - 1)
+        row = min(int((lat - south) / ((north - south) or 1) * size), size - 1)
+        cells[row * size + column].append(number)
+    offsets = [0]
+    for cell in cells:
+        offsets.append(offsets[-1] + len(cell))
+    with open(os.path.join(facets_dir, 'grid.bin'), 'wb') as file:
+        write_typed_array(file, 'I', offsets)
+        write_typed_array(file, 'I', [number for cell in cells for number in cell])
+        # Pad so the Float64 positions start on an 8 byte boundary
+        write_typed_array(file, 'I', [0] * ((len(offsets) + len(listings)) % 2))
+        write_typed_array(file, 'd', [value for cell in cells for number in cell for value in positions[number]])
+    meta["grid"] = {"size": size, "bounds": [west, south, east, north]}
+
+    return meta
+
+def read_typed_array(file, typecode, count):
+    data = array(typecode)
+    data.fromfile(file, count)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data
+
+def load_facets(tiles_dir):
+    """Load the facet indexes written by generate_facets, the way the map page does."""
+    with open(os.path.join(tiles_dir, 'index.json'), 'r') as file:
+        meta = json.load(file)["facets"]
+    facets_dir = os.path.join(tiles_dir, 'facets')
+    facets = {"meta": meta, "numeric": {}}
+
+    for name, length in meta["numeric"].items():
+        with open(os.path.join(facets_dir, f"{name}.bin"), 'rb') as file:
+            facets["numeric"][name] = (read_typed_array(file, 'd', length), read_typed_array(file, 'I', length))
+    with open(os.path.join(facets_dir, f"{meta['category']['name']}.bin"), 'rb') as file:
+        facets["category"] = read_typed_array(file, 'I', meta["category"]["offsets"][-1])
+    cell_count = meta["grid"]["size"] ** 2
+    with open(os.path.join(facets_dir, 'grid.bin'), 'rb') as file:
+        offsets = read_typed_array(file, 'I', cell_count + 1)
+        numbers = read_typed_array(file, 'I', offsets[-1])
+        read_typed_array(file, 'I', (len(offsets) + len(numbers)) % 2)
+        positions = read_typed_array(file, 'd', 2 * offsets[-1])
+    facets["grid"] = (offsets, numbers, positions)
+    return facets
+
+def query_facets(facets, bounds, max_price=None, min_bedrooms=None, min_bathrooms=None, sub_type=None):
+    """Listing numbers inside bounds ([west, south, east, north]) that pass the map filters.
+
+    This is the query the map page runs: every active filter selects one contiguous range of an
+    index, and the ranges are intersected starting from the smallest one.
+    """
+    meta = facets["meta"]
+    ranges = []
+    for name, minimum, maximum in (('listPrice', None, max_price), ('bedrooms', min_bedrooms, None),
+                                   ('bathrooms', min_bathrooms, None)):
+        if minimum is None and maximum is None:
+            continue
+        values, numbers = facets["numeric"][name]
+        start = bisect_left(values, minimum) if minimum is not None else 0
+        end = bisect_right(values, maximum) if maximum is not None else len(values)
+        ranges.append(numbers[start:end])
+    if sub_type:
+        category = meta["category"]
+        if sub_type not in category["values"]:
+            return []
+        index = category["values"].index(sub_type)
+        ranges.append(facets["category"][category["offsets"][index]:category["offsets"][index + 1]])
+
+    # The grid cells overlapping the bounds; only listings in edge cells need their position checked
+    offsets, numbers, positions = facets["grid"]
+    size = meta["grid"]["size"]
+    grid_west, grid_south, grid_east, grid_north = meta["grid"]["bounds"]
+    west, south, east, north = bounds
+    width, height = (grid_east - grid_west) or 1, (grid_north - grid_south) or 1
+    first_column = max(0, int((west - grid_west) / width * size))
+    last_column = min(size - 1, int((east - grid_west) / width * size))
+    first_row = max(0, int((south - grid_south) / height * size))
+    last_row = min(size - 1, int((north - grid_south) / height * size))
+    visible = []
+    for row in range(first_row, last_row + 1):
+        for column in range(first_column, last_column + 1):
+            cell = row * size + column
+            if first_row < row < last_row and first_column < column < last_column:
+                visible.extend(numbers[offsets[cell]:offsets[cell + 1]])
+                continue
+            for position in range(offsets[cell], offsets[cell + 1]):
+                lng, lat = positions[2 * position], positions[2 * position + 1]
+                if west <= lng <= east and south <= lat <= north:
+                    visible.append(numbers[position])
+    ranges.append(visible)
+
+    ranges.sort(key=len)
+    matches = set(ranges[0])
+    for numbers in ranges[1:]:
+        matches.intersection_update(numbers)
+        if not matches:
+            break
+    return sorted(matches)
 
 def main():
     parser = argparse.ArgumentParser(description='Generate a map page with property listings.')
     parser.add_argument('template_dir', help='Directory of the HTML templates')
     parser.add_argument('output_dir', help='Directory to save the generated HTML file')
+    parser.add_argument('--listings', help='Simplified listing file (see mls_convert.py) to cut into map tiles')
+    parser.add_argument('--max-tile-features', type=int, default=MAX_TILE_FEATURES,
+                        help='Largest number of listings stored in one tile')
     args = parser.parse_args()
 
     map_template_path = os.path.join(args.template_dir, 'map_template.html')
@@ -40,6 +367,10 @@ def main():
 
     create_html_page(map_template, master_template, args.output_dir)
 
+    if args.listings:
+        points = load_map_points(args.listings)
+        generate_tiles(points, args.output_dir, args.max_tile_features)
+
 if __name__ == '__main__':
     main()
 
@@ -1,57 +1,161 @@
-import json
-import random
-from geopy.distance import great_circle
+from contextlib import ExitStack
+from listing_data import iter_features, open_listing_writer
 
-def generate_random_coords(origin, max_distance_km):
-    """Generate random coordinates within a specified distance from the origin."""
-    bearing = random.randint(0, 360)
-    distance = random.uniform(0, max_distance_km)
-    new_point = great_circle(kilometers=distance).destination(origin, bearing)
-    return [new_point.longitude, new_point.latitude]
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def process_geojson(input_file, output_file, demo_mode=False):
-    """Process GeoJSON file and convert it to simplified format."""
-    with open(input_file, 'r') as file:
-        data = json.load(file)
-
-    new_features = []
-    origin = (31.9686, -99.9018)
-
-    for feature in data['features']:
-        properties = feature['properties']
-        new_feature = {
-            "type": "Feature",
-            "properties": {
-                "fullAddress": properties['fullAddress']['prettyPrinted'],
-                "bedrooms": properties['bedrooms'],
-                "bathrooms": properties['bathrooms'],
-                "area": properties['area'],
-                "listPrice": properties['listPrice'],
-                "listingPhoto": properties['featuredImage'],
-                "mlsId": properties['mlsId']
-            },
-            "geometry": {
-                "type": "Point",
-                "coordinates": generate_random_coords(origin, 5) if demo_mode else feature['geometry']['coordinates']
-            }
-        }
-        new_features.append(new_feature)
+ORIGIN = (31.9686, -99.9018)
+DEMO_RADIUS_KM = 5
+# Mean earth radius used by geopy's great_circle, which this module used to call per point
+EARTH_RADIUS_KM = 6371.009
+BATCH_SIZE = 4096
+
+def generate_random_coords(origin, max_distance_km, count, rng=None):
+    """Generate `count` random [lng, lat] pairs within a specified distance from the origin.
+
+    The great circle destination for every point is computed as one NumPy batch.
+    """
+    if np is None:
+        raise ImportError("The numpy module is required for demo mode (pip install numpy).")
+    rng = rng or np.random.default_rng()
+    bearings = np.radians(rng.integers(0, 361, count))
+    distances = rng.uniform(0, max_distance_km, count) / EARTH_RADIUS_KM
+
+    lat1, lng1 = np.radians(origin[0]), np.radians(origin[1])
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(distances) + np.cos(lat1) * np.sin(distances) * np.cos(bearings))
+    lng2 = lng1 + np.arctan2(np.sin(bearings) * np.sin(distances) * np.cos(lat1),
+                             np.cos(distances) - np.sin(lat1) * np.sin(lat2))
+    # Wrap longitudes into [-180, 180)
+    lng2 = (lng2 + 3 * np.pi) % (2 * np.pi) - np.pi
 
-    new_data = {
-        "type": "FeatureCollection",
-        "features": new_features
+    return np.column_stack((np.degrees(lng2), np.degrees(lat2))).tolist()
+
+def simplify_feature(feature, coordinates=None):
+    """Project a full listing feature onto the slim record used by the map and listings shortcode."""
+    properties = feature['properties']
+    return {
+        "type": "Feature",
+        "properties": {
+            "fullAddress": properties['fullAddress']['prettyPrinted'],
+            "bedrooms": properties['bedrooms'],
+            "bathrooms": properties['bathrooms'],
+            "area": properties['area'],
+            "listPrice": properties['listPrice'],
+            "listingPhoto": properties['featuredImage'],
+            "mlsId": properties['mlsId'],
+            "subType": properties.get('subType')
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": coordinates if coordinates is not None else feature['geometry']['coordinates']
+        }
     }
 
-    with open(output_file, 'w') as file:
-        json.dump(new_data, file, indent=4)
+
+class ListingFanOut:
+    """Writes each listing to several outputs in a single pass.
+
+    - full_output receives the feature unchanged (e.g. to keep a compact .mlspack copy).
+    - slim_output receives the simplified projection with the real coordinates.
+    - demo_output receives the simplified projection with random coordinates near the origin.
+
+    Features are buffered in batches so the demo coordinates can be generated with one vectorized
+    call per batch. Every output is written atomically, and checkpoint()/resume_state work as they
+    do for the individual writers in listing_data.py.
+    """
+
+    def __init__(self, full_output=None, slim_output=None, demo_output=None, origin=ORIGIN,
+                 demo_radius_km=DEMO_RADIUS_KM, resume_state=None, keep_partial=False, allow_empty=False):
+        self.paths = {"full": full_output, "slim": slim_output, "demo": demo_output}
+        self.origin = origin
+        self.demo_radius_km = demo_radius_km
+        self.resume_state = resume_state or {}
+        self.keep_partial = keep_partial
+        self.allow_empty = allow_empty
+        self.writers = {}
+        self.batch = []
+        self.count = self.resume_state.get("count", 0)
+        self.stack = None
+
+    def __enter__(self):
+        with ExitStack() as stack:
+            for kind, path in self.paths.items():
+                if path:
+                    writer = open_listing_writer(path, allow_empty=self.allow_empty,
+                                                 resume_state=self.resume_state.get(kind),
+                                                 keep_partial=self.keep_partial)
+                    self.writers[kind] = stack.enter_context(writer)
+            self.stack = stack.pop_all()
+        return self
+
+    def write_feature(self, feature):
+        self.batch.append(feature)
+        self.count += 1
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        demo_coords = None
+        if "demo" in self.writers:
+            demo_coords = generate_random_coords(self.origin, self.demo_radius_km, len(self.batch))
+
+        for index, feature in enumerate(self.batch):
+            if "full" in self.writers:
+                self.writers["full"].write_feature(feature)
+            if "slim" in self.writers:
+                self.writers["slim"].write_feature(simplify_feature(feature))
+            if demo_coords is not None:
+                self.writers["demo"].write_feature(simplify_feature(feature, demo_coords[index]))
+        self.batch = []
+
+    def checkpoint(self):
+        self.flush()
+        state = {kind: writer.checkpoint() for kind, writer in self.writers.items()}
+        state["count"] = self.count
+        return state
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        except BaseException as error:
+            # The writers still close, and see the error, so they do not replace the outputs
+            self.stack.__exit__(type(error), error, error.__traceback__)
+            raise
+        return self.stack.__exit__(exc_type, exc_value, traceback)
+
+def convert_listings(input_file, full_output=None, slim_output=None, demo_output=None):
+    """Read every feature of input_file once and write all requested outputs."""
+    with ListingFanOut(full_output, slim_output, demo_output, allow_empty=True) as fan_out:
+        for feature in iter_features(input_file):
+            fan_out.write_feature(feature)
+    return fan_out.count
+
+def process_geojson(input_file, output_file, demo_mode=False):
+    """Process GeoJSON file and convert it to simplified format."""
+    if demo_mode:
+        return convert_listings(input_file, demo_output=output_file)
+    return convert_listings(input_file, slim_output=output_file)
 
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Convert GeoJSON to a simplified format.")
-    parser.add_argument("input_file", help="Path to the input GeoJSON file")
-    parser.add_argument("output_file", help="Path to the output GeoJSON file")
+    parser.add_argument("input_file", help="Path to the input GeoJSON or .mlspack file")
+    parser.add_argument("output_file", nargs='?', help="Path to the output GeoJSON or .mlspack file")
     parser.add_argument("--demo", action="store_true", help="Enable demo mode with random coordinates")
+    parser.add_argument("--full-output", help="Also write an unchanged copy of every listing (e.g. a .mlspack file)")
+    parser.add_argument("--demo-output", help="Also write the simplified listings with random coordinates")
 
     args = parser.parse_args()
-    process_geojson(args.input_file, args.output_file, args.demo)
+    slim_output = args.output_file if not args.demo else None
+    demo_output = args.demo_output or (args.output_file if args.demo else None)
+    if not (slim_output or demo_output or args.full_output):
+        parser.error("no output file given")
+
+    count = convert_listings(args.input_file, args.full_output, slim_output, demo_output)
+    print(f"Converted {count} listings.")
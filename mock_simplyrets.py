@@ -0,0 +1,219 @@
+"""
+Mock SimplyRETS Server
+
+A local stand-in for the SimplyRETS `/properties` endpoint, used to test and load-test
+downloadmls.py without touching the real API. Listings are generated on the fly from their
+mlsId, so the server uses the same small amount of memory whether it serves 1,000 or
+1,000,000 listings, and every run sees the same data.
+
+Supported query parameters: `limit`, `lastId`, `status` and `lastModified`. Pages carry a
+`Link: <...>; rel="next"` header while more listings remain, and the first page carries the
+number of matching listings in `X-Total-Count`, like the real API.
+
+Failures can be injected to exercise the client's retry logic:
+- `--latency` adds a delay (in seconds) to every response.
+- `--error-rate` is the fraction of requests answered with a 500.
+- `--throttle-rate` is the fraction of requests answered with a 429 and a `Retry-After` header.
+
+GET /stats returns the number of requests, errors and throttled responses served so far.
+
+To run the server:
+python mock_simplyrets.py --count 10000 --port 8080 --throttle-rate 0.05
+
+Then point the downloader at it:
+python downloadmls.py --api-url http://127.0.0.1:8080/properties --api_key_file key.txt --api_secret_file secret.txt
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+STATUSES = ['Active', 'Active', 'Active', 'Pending', 'ActiveUnderContract', 'ComingSoon', 'Closed']
+CITIES = [('Houston', '770'), ('The Woodlands', '773'), ('Katy', '774'), ('Sugar Land', '774'), ('Cypress', '774')]
+STREETS = ['Main St', 'Oak Dr', 'Cypress Creek Pkwy', 'Memorial Dr', 'Westheimer Rd', 'Kirby Dr']
+SUB_TYPES = ['SingleFamilyResidence', 'Townhouse', 'Condominium']
+AGENTS = ['Jane Doe', 'John Smith', 'Alice Johnson', 'Bob Williams', 'Carol Brown']
+OFFICES = ['Lone Star Realty', 'Bayou City Homes', 'Gulf Coast Properties']
+BASE_MODIFIED = datetime(2024, 1, 1)
+
+def listing_status(mls_id):
+    # Multiplicative hashing spreads consecutive ids across the statuses
+    return STATUSES[(mls_id * 2654435761 >> 8) % len(STATUSES)]
+
+def listing_modified(mls_id):
+    return (BASE_MODIFIED + timedelta(minutes=mls_id * 37 % 525600)).strftime("%Y-%m-%dT%H:%M:%S.000000Z")
+
+def generate_property(mls_id):
+    """Build a SimplyRETS style property record. The same mlsId always gives the same record."""
+    rng = random.Random(mls_id)
+    city, postal_prefix = rng.choice(CITIES)
+    street_number = rng.randint(100, 99999)
+    street_name = rng.choice(STREETS)
+    postal_code = f"{postal_prefix}{rng.randint(0, 99):02d}"
+    photos = [f"https://photos.example.com/{mls_id}/{index}.jpg" for index in range(rng.randint(1, 8))]
+
+    return {
+        "mlsId": mls_id,
+        "listPrice": rng.randrange(90000, 2500000, 1000),
+        "yearBuilt": rng.randint(1950, 2024),
+        "remarks": f"Synthetic listing {mls_id} on {street_name} in {city}.",
+        "virtualTourUrl": None,
+        "modified": listing_modified(mls_id),
+        "photos": photos,
+        "address": {
+            "full": f"{street_number} {street_name}",
+            "streetNumberText": str(street_number),
+            "streetName": street_name,
+            "city": city,
+            "state": "Texas",
+            "postalCode": postal_code,
+            "country": "United States",
+            "geo": {"lat": round(rng.uniform(29.5, 30.3), 6), "lng": round(rng.uniform(-95.9, -95.1), 6)}
+        },
+        "property": {
+            "bedrooms": rng.randint(1, 6),
+            "bathsFull": rng.randint(1, 4),
+            "bathsHalf": rng.randint(0, 2),
+            "area": rng.randint(600, 6000),
+            "subType": rng.choice(SUB_TYPES),
+            "subdivision": f"{city} Estates",
+            "cooling": "Central",
+            "heating": "Central Gas",
+            "parking": {"spaces": rng.randint(0, 3)},
+            "flooring": "Wood, Tile",
+            "lotSize": str(rng.randint(2000, 20000)),
+            "water": None,
+            "view": None,
+            "construction": "Brick"
+        },
+        "listingAgent": {"fullName": rng.choice(AGENTS), "office": {"name": rng.choice(OFFICES)}},
+        "sales": {},
+        "mls": {"status": listing_status(mls_id)}
+    }
+
+
+class MockConfig:
+    def __init__(self, count=1000, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, seed=0):
+        self.count = count
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0, "listings": 0}
+
+    def count_stat(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+
+class MockSimplyRETSHandler(BaseHTTPRequestHandler):
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            with self.config.lock:
+                return self.send_json(200, dict(self.config.stats))
+        if url.path != '/properties':
+            return self.send_json(404, {"message": "Not found"})
+
+        config = self.config
+        config.count_stat("requests")
+        if config.latency:
+            time.sleep(config.latency)
+
+        roll = config.roll()
+        if roll < config.throttle_rate:
+            config.count_stat("throttled")
+            return self.send_json(429, {"message": "Rate limit exceeded"},
+                                  {'Retry-After': str(config.retry_after)})
+        if roll < config.throttle_rate + config.error_rate:
+            config.count_stat("errors")
+            return self.send_json(500, {"message": "Internal server error"})
+
+        query = parse_qs(url.query)
+        limit = min(int(query.get('limit', ['20'])[0]), 500)
+        last_id = int(query.get('lastId', ['0'])[0])
+        statuses = set(query.get('status', [''])[0].split(',')) - {''}
+        modified_since = query.get('lastModified', [None])[0]
+
+        def matches(mls_id):
+            if statuses and listing_status(mls_id) not in statuses:
+                return False
+            return not (modified_since and listing_modified(mls_id) <= modified_since)
+
+        page = []
+        mls_id = last_id
+        while mls_id < config.count and len(page) < limit:
+            mls_id += 1
+            if matches(mls_id):
+                page.append(generate_property(mls_id))
+
+        headers = {}
+        if last_id == 0:
+            headers['X-Total-Count'] = str(sum(1 for other_id in range(1, config.count + 1) if matches(other_id)))
+        if page and mls_id < config.count:
+            host, port = self.server.server_address[:2]
+            next_query = f"limit={limit}&lastId={page[-1]['mlsId']}"
+            for name in ('status', 'lastModified'):
+                if name in query:
+                    next_query += f"&{name}={query[name][0]}"
+            headers['Link'] = f'<http://{host}:{port}/properties?{next_query}>; rel="next"'
+
+        config.count_stat("listings", len(page))
+        self.send_json(200, page, headers)
+
+def start_mock_server(config, host='127.0.0.1', port=0):
+    """Start the server on a background thread. Returns the server; its URL is server.url."""
+    handler = type('ConfiguredHandler', (MockSimplyRETSHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.url = f"http://{host}:{server.server_address[1]}/properties"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve synthetic listings from a local SimplyRETS stand-in.')
+    parser.add_argument('--count', type=int, default=1000, help='Number of listings to serve')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='Delay added to every response, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After value sent with 429 responses')
+    args = parser.parse_args()
+
+    config = MockConfig(args.count, args.latency, args.error_rate, args.throttle_rate, args.retry_after)
+    server = start_mock_server(config, args.host, args.port)
+    print(f"Serving {args.count} synthetic listings at {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
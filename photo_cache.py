@@ -0,0 +1,242 @@
+"""
+Listing Photo Cache
+
+Downloads listing photos into a local content-addressed cache and generates resized JPEG and
+WebP variants of each one, so pages can serve appropriately sized images instead of
+hotlinking full size originals.
+
+- Originals are stored as `<cache_dir>/originals/<sha256>` and never downloaded again once a
+  URL is in the cache index. Sources can be http(s) URLs, file:// URLs or local paths.
+- Variants are written to `<output_dir>/photos/<sha256>_<width>.jpg` / `.webp`. Because the
+  names are content hashes, an unchanged photo is never resized again.
+- Resizing runs in a process pool, downloads run in a thread pool.
+- A manifest maps every photo URL to its variants with their widths and heights. It is read by
+  listing_pages_generator.py and listing_list_page.py (--photos) to emit `srcset`,
+  `width`/`height` and `loading="lazy"` attributes.
+- A URL that fails to download is recorded in the cache index and not tried again until its
+  retry time, which starts at an hour and doubles on every failure up to a week. --retry-failed
+  tries them all again now.
+- build.py runs this as its `photos` stage before the listing pages and list pages.
+
+To run the script:
+python photo_cache.py mls_data.geojson dummyweb --manifest photo_manifest.json --workers 4
+
+Requires the Pillow module (pip install Pillow).
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from html import escape
+
+from listing_model import load_listing_records
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+PHOTO_WIDTHS = [320, 640, 1024, 1600]
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+PHOTOS_URL_PATH = '/photos'
+DEFAULT_CACHE_DIR = os.path.join('.build_cache', 'photos')
+DEFAULT_SIZES = '(max-width: 680px) 100vw, 50vw'
+# A URL that could not be downloaded is tried again after this delay, doubled on every further
+# failure up to the maximum, so each run does not wait on the same broken or unreachable URLs
+RETRY_DELAY = 60 * 60
+MAX_RETRY_DELAY = 7 * 24 * 60 * 60
+
+def collect_photo_urls(listings_file, listings=None):
+    urls = []
+    seen = set()
+    for listing in listings if listings is not None else load_listing_records(listings_file):
+        for url in listing.images:
+            if url and url not in seen:
+                seen.add(url)
+                urls.append(url)
+    return urls
+
+def load_index(cache_dir):
+    index_path = os.path.join(cache_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return {"urls": {}, "photos": {}, "failures": {}}
+    with open(index_path, 'r') as file:
+        index = json.load(file)
+    index.setdefault("failures", {})
+    return index
+
+def save_index(index, cache_dir):
+    index_path = os.path.join(cache_dir, 'index.json')
+    with open(index_path + '.tmp', 'w') as file:
+        json.dump(index, file)
+    os.replace(index_path + '.tmp', index_path)
+
+def download_photo(url, originals_dir):
+    """Download a photo into the cache and return the sha256 of its bytes."""
+    source = url if '://' in url else 'file://' + os.path.abspath(url)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=originals_dir, delete=False) as temp_file:
+        try:
+            with urllib.request.urlopen(source, timeout=30) as response:
+                for chunk in iter(lambda: response.read(65536), b''):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+        except Exception:
+            os.remove(temp_file.name)
+            raise
+
+    photo_hash = digest.hexdigest()
+    os.replace(temp_file.name, os.path.join(originals_dir, photo_hash))
+    return photo_hash
+
+def resize_photo(original_path, photos_dir, photo_hash, widths=PHOTO_WIDTHS):
+    """Write the JPEG and WebP variants of one photo. Runs in a worker process."""
+    with Image.open(original_path) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+
+    width, height = image.size
+    variants = []
+    # Never upscale: the largest variant is the original size
+    targets = sorted({min(target, width) for target in widths})
+    for target in targets:
+        target_height = max(1, round(height * target / width))
+        resized = image if target == width else image.resize((target, target_height), Image.LANCZOS)
+        jpeg_name = f"{photo_hash}_{target}.jpg"
+        webp_name = f"{photo_hash}_{target}.webp"
+        resized.save(os.path.join(photos_dir, jpeg_name), 'JPEG', quality=JPEG_QUALITY, optimize=True,
+                     progressive=True)
+        resized.save(os.path.join(photos_dir, webp_name), 'WEBP', quality=WEBP_QUALITY)
+        variants.append({"width": target, "height": target_height, "jpg": jpeg_name, "webp": webp_name})
+
+    return photo_hash, {"width": width, "height": height, "variants": variants}
+
+def variants_exist(record, photos_dir):
+    return all(os.path.exists(os.path.join(photos_dir, variant[kind]))
+               for variant in record["variants"] for kind in ('jpg', 'webp'))
+
+def record_failure(index, url, now):
+    failure = index["failures"].get(url, {"attempts": 0})
+    failure["attempts"] += 1
+    failure["retry_at"] = now + min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (failure["attempts"] - 1))
+    index["failures"][url] = failure
+
+def cache_photos(listings_file, output_dir, cache_dir=DEFAULT_CACHE_DIR, manifest_path='photo_manifest.json',
+                 workers=None, listings=None, retry_failed=False):
+    """Cache the photos of every listing and write the manifest.
+
+    Returns the manifest and the number of photos that are missing from it: those that failed in
+    this run and those skipped because they failed recently (unless retry_failed is set).
+    listings, if given, are the records already parsed from listings_file.
+    """
+    if Image is None:
+        raise ImportError("The Pillow module is required to build the photo cache (pip install Pillow).")
+
+    originals_dir = os.path.join(cache_dir, 'originals')
+    photos_dir = os.path.join(output_dir, 'photos')
+    os.makedirs(originals_dir, exist_ok=True)
+    os.makedirs(photos_dir, exist_ok=True)
+
+    index = load_index(cache_dir)
+    urls = collect_photo_urls(listings_file, listings)
+
+    # Download only URLs that have never been fetched, and that have not failed recently
+    now = time.time()
+    missing = [url for url in urls
+               if url not in index["urls"] or not os.path.exists(os.path.join(originals_dir, index["urls"][url]))]
+    skipped = [url for url in missing
+               if not retry_failed and index["failures"].get(url, {}).get("retry_at", 0) > now]
+    missing = [url for url in missing if url not in skipped]
+    downloaded = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(4, (workers or os.cpu_count() or 1) * 2)) as executor:
+        futures = {url: executor.submit(download_photo, url, originals_dir) for url in missing}
+        for url, future in futures.items():
+            try:
+                index["urls"][url] = future.result()
+                index["failures"].pop(url, None)
+                downloaded += 1
+            except Exception as e:
+                failed += 1
+                record_failure(index, url, now)
+                print(f"Could not download {url}: {e}")
+
+    # Resize only photos whose variants are not already on disk
+    hashes = {index["urls"][url] for url in urls if url in index["urls"]}
+    pending = [photo_hash for photo_hash in sorted(hashes)
+               if photo_hash not in index["photos"] or not variants_exist(index["photos"][photo_hash], photos_dir)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(resize_photo, os.path.join(originals_dir, photo_hash), photos_dir, photo_hash)
+                   for photo_hash in pending]
+        for future in futures:
+            try:
+                photo_hash, record = future.result()
+                index["photos"][photo_hash] = record
+            except Exception as e:
+                failed += 1
+                print(f"Could not resize photo: {e}")
+
+    save_index(index, cache_dir)
+
+    manifest = {}
+    for url in urls:
+        record = index["photos"].get(index["urls"].get(url))
+        if record:
+            manifest[url] = {
+                "width": record["width"],
+                "height": record["height"],
+                "variants": [dict(variant,
+                                  jpg=f"{PHOTOS_URL_PATH}/{variant['jpg']}",
+                                  webp=f"{PHOTOS_URL_PATH}/{variant['webp']}")
+                             for variant in record["variants"]]
+            }
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file)
+
+    print(f"Photos: {len(urls)} referenced, {downloaded} downloaded, {len(pending)} resized, {failed} failed, "
+          f"{len(skipped)} skipped after an earlier failure.")
+    return manifest, len(urls) - len(manifest)
+
+def load_photo_manifest(manifest_path):
+    if not manifest_path:
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+def image_attributes(entry, lazy=True, sizes=DEFAULT_SIZES):
+    """HTML attributes for an <img> with the cached variants of a photo, ending in a space."""
+    largest = entry["variants"][-1]
+    srcset = ', '.join(f"{variant['jpg']} {variant['width']}w" for variant in entry["variants"])
+    attributes = (f'srcset="{escape(srcset)}" sizes="{sizes}" width="{largest["width"]}" '
+                  f'height="{largest["height"]}" ')
+    if lazy:
+        attributes += 'loading="lazy" decoding="async" '
+    return attributes
+
+def picture_html(entry, alt, lazy=True, sizes=DEFAULT_SIZES):
+    """A <picture> element serving WebP where supported and the JPEG variants otherwise."""
+    webp_srcset = ', '.join(f"{variant['webp']} {variant['width']}w" for variant in entry["variants"])
+    largest = entry["variants"][-1]
+    return (f'<picture><source type="image/webp" srcset="{escape(webp_srcset)}" sizes="{sizes}">'
+            f'<img src="{largest["jpg"]}" {image_attributes(entry, lazy, sizes)}alt="{alt}"></picture>')
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache listing photos and generate responsive image variants.')
+    parser.add_argument('json_file', help='Listing file whose photos should be cached')
+    parser.add_argument('output_dir', help='Site directory; variants are written to its photos folder')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory for downloaded originals')
+    parser.add_argument('--manifest', default='photo_manifest.json', help='Where to write the photo manifest')
+    parser.add_argument('--workers', type=int, help='Worker processes used for resizing')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Download photos that failed recently again instead of waiting for their retry time')
+    args = parser.parse_args()
+
+    cache_photos(args.json_file, args.output_dir, args.cache_dir, args.manifest, args.workers,
+                 retry_failed=args.retry_failed)
+
+if __name__ == '__main__':
+    main()
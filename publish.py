@@ -0,0 +1,183 @@
+"""
+Site Publisher
+
+Publishes a built site as an immutable release and switches the served site to it in one step,
+so visitors never see a half-written page or a page that links to one that was just deleted.
+
+Layout of the site root:
+- `releases/<release id>/` holds one complete copy of the site per publish.
+- `releases/<release id>.json` records the size, modification time and sha256 of every file of
+  that release.
+- `current` is a symlink to the release being served.
+
+Publishing works in three steps:
+1. The build output is copied into a hidden staging folder under `releases/`. Files whose bytes
+   are unchanged since the previous release are hard-linked to it instead of copied, so a
+   publish costs only the files that changed. A file whose size and modification time match
+   the previous release's record is not even read.
+2. The staging folder is renamed to its release id once it is complete.
+3. `current` is replaced with a symlink to the new release with a single rename, which is atomic.
+
+The newest `--keep` releases are kept, so going back to the previous one is instant:
+python publish.py site --rollback
+
+To run the script:
+python publish.py site --source dummyweb --keep 5
+
+Where `site` is the site root and `dummyweb` is the build output. The web server should serve
+`site/current` (see the `publish` profile in docker-compose.yml).
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+
+RELEASES_DIR = 'releases'
+CURRENT_LINK = 'current'
+DEFAULT_KEEP = 5
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def current_release(site_root):
+    link = os.path.join(site_root, CURRENT_LINK)
+    if not os.path.islink(link):
+        return None
+    return os.path.basename(os.readlink(link))
+
+def list_releases(site_root):
+    releases_dir = os.path.join(site_root, RELEASES_DIR)
+    if not os.path.isdir(releases_dir):
+        return []
+    return sorted(name for name in os.listdir(releases_dir)
+                  if not name.startswith('.') and os.path.isdir(os.path.join(releases_dir, name)))
+
+def load_release_manifest(site_root, release):
+    if not release:
+        return {}
+    manifest_path = os.path.join(site_root, RELEASES_DIR, release + '.json')
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+def switch_release(site_root, release):
+    # Build the new link next to the old one and rename it over it: readers see either release, never neither
+    link = os.path.join(site_root, CURRENT_LINK)
+    temp_link = f"{link}.tmp-{os.getpid()}"
+    os.symlink(os.path.join(RELEASES_DIR, release), temp_link)
+    os.replace(temp_link, link)
+
+def stage_release(source_dir, staging_dir, previous_dir, previous_manifest):
+    """Copy source_dir into staging_dir, hard-linking files that are unchanged in previous_dir."""
+    manifest = {}
+    stats = {"linked": 0, "copied": 0, "copied_bytes": 0}
+    for directory, _, file_names in os.walk(source_dir):
+        relative_dir = os.path.relpath(directory, source_dir)
+        os.makedirs(os.path.join(staging_dir, relative_dir), exist_ok=True)
+        for file_name in file_names:
+            relative_path = os.path.normpath(os.path.join(relative_dir, file_name))
+            source_path = os.path.join(source_dir, relative_path)
+            target_path = os.path.join(staging_dir, relative_path)
+            stat = os.stat(source_path)
+
+            # Trust the previous record when the file was not touched since, and only hash it otherwise
+            previous = previous_manifest.get(relative_path)
+            if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+                digest = previous["sha256"]
+            else:
+                digest = file_digest(source_path)
+            manifest[relative_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+
+            previous_path = os.path.join(previous_dir, relative_path) if previous_dir else None
+            if previous and previous["sha256"] == digest and os.path.isfile(previous_path):
+                os.link(previous_path, target_path)
+                stats["linked"] += 1
+            else:
+                shutil.copy2(source_path, target_path)
+                stats["copied"] += 1
+                stats["copied_bytes"] += stat.st_size
+    return manifest, stats
+
+def prune_releases(site_root, keep):
+    releases_dir = os.path.join(site_root, RELEASES_DIR)
+    active = current_release(site_root)
+    releases = list_releases(site_root)
+    removed = []
+    for release in releases[:max(0, len(releases) - keep)]:
+        if release == active:
+            continue
+        shutil.rmtree(os.path.join(releases_dir, release))
+        manifest_path = os.path.join(releases_dir, release + '.json')
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        removed.append(release)
+    return removed
+
+def publish(source_dir, site_root, keep=DEFAULT_KEEP):
+    """Publish source_dir as a new release of site_root and serve it. Returns the release id."""
+    if not os.path.isdir(source_dir):
+        raise FileNotFoundError(f"Build output {source_dir} does not exist.")
+    releases_dir = os.path.join(site_root, RELEASES_DIR)
+    os.makedirs(releases_dir, exist_ok=True)
+
+    previous = current_release(site_root)
+    previous_dir = os.path.join(releases_dir, previous) if previous else None
+    release = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    staging_dir = os.path.join(releases_dir, '.staging-' + release)
+
+    try:
+        manifest, stats = stage_release(source_dir, staging_dir, previous_dir,
+                                        load_release_manifest(site_root, previous))
+        with open(os.path.join(releases_dir, release + '.json'), 'w') as file:
+            json.dump(manifest, file)
+        os.rename(staging_dir, os.path.join(releases_dir, release))
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    switch_release(site_root, release)
+    removed = prune_releases(site_root, keep)
+
+    print(f"Published release {release}: {stats['copied']} files copied ({stats['copied_bytes'] / 1024:.1f}KB), "
+          f"{stats['linked']} unchanged files linked, {len(removed)} old releases removed.")
+    return release
+
+def rollback(site_root, release=None):
+    """Serve the given release, or the one published before the current release."""
+    releases = list_releases(site_root)
+    active = current_release(site_root)
+    if release is None:
+        older = [name for name in releases if active is None or name < active]
+        if not older:
+            raise ValueError("There is no earlier release to roll back to.")
+        release = older[-1]
+    elif release not in releases:
+        raise ValueError(f"Release {release} does not exist.")
+
+    switch_release(site_root, release)
+    print(f"Now serving release {release} (was {active}).")
+    return release
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish a built site as an atomic release.')
+    parser.add_argument('site_root', help='Directory holding the releases and the current symlink')
+    parser.add_argument('--source', default='dummyweb', help='Build output to publish')
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP, help='Number of releases to keep')
+    parser.add_argument('--rollback', nargs='?', const='', metavar='RELEASE',
+                        help='Serve an earlier release instead of publishing (default: the previous one)')
+    args = parser.parse_args()
+
+    if args.rollback is not None:
+        rollback(args.site_root, args.rollback or None)
+    else:
+        publish(args.source, args.site_root, args.keep)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Rebuild Worker
+
+Rebuilds the site in the background after edits made in the GUI editor (guieditor.py), so a
+saved page is live without running the whole build by hand.
+
+The editor queues only what an edit affects:
+- A page saved, created or deleted in template/pages rebuilds just that page
+  (see generic_page.process_files).
+- An edit of data.json or another template file rebuilds the master template and every stage
+  that depends on it (see build.py).
+- An edit of a shortcode script rebuilds the generic pages. Only the pages that use the script
+  are rendered again.
+
+Edits are collected until DEBOUNCE_SECONDS pass without a new one, and then run as one job, so a
+burst of saves costs a single rebuild. Jobs run one at a time on a background thread of the
+editor's process, so the parsed listings and compiled templates are reused from job to job.
+
+Each job records its status (queued, running, done or failed), its progress in steps, the steps
+it ran and how long it took. The editor serves the jobs at /rebuild/jobs and streams every change
+at /rebuild/events as server-sent events.
+
+Usage:
+from rebuild_worker import RebuildWorker
+
+worker = RebuildWorker('template', 'dummyweb')
+job = worker.queue(pages=['about.md'])
+print(worker.wait(job["id"]))
+"""
+import copy
+import os
+import threading
+import time
+from datetime import datetime
+
+import build
+import generic_page
+import shortcode_cache
+
+DEBOUNCE_SECONDS = 0.2
+# Finished jobs kept for the status endpoints
+MAX_JOBS = 50
+
+class RebuildWorker:
+    def __init__(self, template_dir, output_dir, debounce=DEBOUNCE_SECONDS):
+        self.args = build.parse_args([template_dir, output_dir])
+        self.debounce = debounce
+        # Lives as long as the editor, so a job only parses the data files that changed
+        self.context = generic_page.DataContext(os.getcwd())
+        self.condition = threading.Condition()
+        self.jobs = []
+        self.pending = None
+        self.due = 0
+        self.next_id = 1
+        # Bumped on every change to a job; each job keeps the version of its last change
+        self.version = 0
+        self.thread = None
+
+    def queue(self, pages=(), stages=()):
+        """Add pages and stages to the job waiting to run and return a copy of it."""
+        with self.condition:
+            if self.pending is None:
+                self.pending = {"id": self.next_id, "status": "queued", "pages": [], "stages": [],
+                                "queued": datetime.now().isoformat(timespec='seconds'), "started": None,
+                                "finished": None, "duration": None, "progress": {"done": 0, "total": 0},
+                                "steps": [], "error": None}
+                self.next_id += 1
+                self.jobs.append(self.pending)
+                del self.jobs[:-MAX_JOBS]
+            job = self.pending
+            job["pages"] += [page for page in pages if page not in job["pages"]]
+            job["stages"] += [stage for stage in stages if stage not in job["stages"]]
+            self.due = time.monotonic() + self.debounce
+            self.changed(job)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='rebuild-worker', daemon=True)
+                self.thread.start()
+            return copy.deepcopy(job)
+
+    def changed(self, job):
+        # Called with the condition held
+        self.version += 1
+        job["version"] = self.version
+        self.condition.notify_all()
+
+    def update(self, job, **changes):
+        with self.condition:
+            job.update(changes)
+            self.changed(job)
+
+    def run(self):
+        while True:
+            with self.condition:
+                # Wait for a job, then until its edits have stopped coming in
+                while self.pending is None or time.monotonic() < self.due:
+                    self.condition.wait(None if self.pending is None else self.due - time.monotonic())
+                job = self.pending
+                self.pending = None
+            self.execute(job)
+
+    def step(self, job, record):
+        with self.condition:
+            job["steps"].append(record)
+            job["progress"]["done"] += 1
+            self.changed(job)
+
+    def execute(self, job):
+        start = time.perf_counter()
+        stages = build.dependent_stages(build.STAGES, job["stages"]) if job["stages"] else {}
+        # The generic pages stage already renders every page that changed
+        pages = [] if 'generic_pages' in stages else job["pages"]
+        self.update(job, status="running", started=datetime.now().isoformat(timespec='seconds'),
+                    progress={"done": 0, "total": len(stages) + (1 if pages else 0)})
+
+        error = None
+        try:
+            if stages:
+                build.run_build(stages, self.args, self.context, on_record=lambda record: self.step(job, record))
+            if pages:
+                pages_start = time.perf_counter()
+                template_context = generic_page.DataContext(self.args.template_dir, self.context.files,
+                                                            self.context.lock)
+                written = generic_page.process_files(
+                    self.args.template_dir, self.args.output_dir, os.path.abspath(shortcode_cache.DEFAULT_CACHE),
+                    context=template_context, manifest_path=os.path.abspath(generic_page.DEFAULT_MANIFEST),
+                    file_names=pages)
+                self.step(job, {"stage": "pages", "status": "ok", "files": len(written),
+                                "wall_time": round(time.perf_counter() - pages_start, 3)})
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        failed = error or any(step["status"] not in ("ok", "warning") for step in job["steps"])
+        self.update(job, status="failed" if failed else "done", error=error,
+                    finished=datetime.now().isoformat(timespec='seconds'),
+                    duration=round(time.perf_counter() - start, 3))
+
+    def get_jobs(self, since=0):
+        """Copies of the jobs changed after version since, oldest first."""
+        with self.condition:
+            return [copy.deepcopy(job) for job in self.jobs if job["version"] > since]
+
+    def get_job(self, job_id):
+        with self.condition:
+            return next((copy.deepcopy(job) for job in self.jobs if job["id"] == job_id), None)
+
+    def wait_for_change(self, since, timeout=None):
+        """Wait until a job changes after version since; returns the current version."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version > since, timeout)
+            return self.version
+
+    def wait(self, job_id, timeout=None):
+        """Wait until a job has finished and return a copy of it."""
+        with self.condition:
+            self.condition.wait_for(lambda: (self.get_job(job_id) or {}).get("status") in ("done", "failed", None),
+                                    timeout)
+            return self.get_job(job_id)
@@ -0,0 +1,277 @@
+"""
+Search Index
+
+Builds the static search page (search.html) and the prebuilt index it queries, so visitors can
+search the listings by address, city, postal code, subdivision, agent or remarks without a
+server and without downloading mls_data.geojson.
+
+The index is written to `search/` in the output directory:
+- `index.json` holds the shard list, the price steps and the settings the page needs.
+- `shards/<prefix>.json` maps every word that starts with <prefix> to the listings that contain
+  it. Words are grouped by their first PREFIX_LENGTH characters, and a shard larger than
+  MAX_SHARD_SIZE is split by one more character, so a word lives in the shard with the longest
+  prefix of it. A query only downloads the shards of its words.
+- Listings are numbered by price, so a price range is a contiguous range of listing numbers.
+  `prices/<chunk>.bin` holds the prices of PRICE_CHUNK listings each (Float64), and a price filter
+  only reads the one or two chunks around its bounds. `bedrooms/<chunk>.bin` holds the bedrooms
+  of BEDROOM_CHUNK listings each (Uint8), read only for chunks that still have matches.
+- `docs/<chunk>.json` holds the address, price, rooms and photo of DOC_CHUNK listings each,
+  for showing the results.
+
+Postings are stored as gaps between listing numbers, and a negative entry -n stands for n more
+consecutive listings, so words found in nearly every listing stay small.
+
+The last word of a query matches every word it starts, so results update while typing.
+
+To run the script:
+python search_index.py template dummyweb mls_data.geojson
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from listing_model import load_listing_records
+from map_maker import read_typed_array, write_typed_array
+from template_engine import load_template
+
+SEARCH_DIR = 'search'
+PREFIX_LENGTH = 2
+MAX_SHARD_SIZE = 16 * 1024
+PRICE_CHUNK = 512
+BEDROOM_CHUNK = 4096
+DOC_CHUNK = 8
+# search.html shows this many results at a time
+MAX_SHOWN_RESULTS = 10
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# Words too common to narrow a search down; search.html drops them from queries too
+STOP_WORDS = {'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or',
+              'that', 'the', 'this', 'to', 'with'}
+
+def create_html_page(search_template, master_template, destination_folder):
+    html_content = master_template.safe_substitute(
+        content=search_template.safe_substitute(),
+        title="Search Listings",
+        current_year=datetime.now().year
+    )
+    file_path = os.path.join(destination_folder, "search.html")
+    with open(file_path, 'w') as file:
+        file.write(html_content)
+    return file_path
+
+def tokenize(text):
+    """Lowercase words of at least PREFIX_LENGTH letters or digits, as search.html splits queries."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower())
+            if len(token) >= PREFIX_LENGTH and token not in STOP_WORDS]
+
+def listing_text(listing):
+    properties = listing.properties
+    full_address = properties.get("fullAddress")
+    postal_code = full_address.get("postalCode") if isinstance(full_address, dict) else None
+    fields = [listing.address, listing.city, postal_code, properties.get("subdivision"),
+              properties.get("agentName"), properties.get("remarks")]
+    return ' '.join(str(field) for field in fields if field)
+
+def encode_postings(numbers):
+    encoded = []
+    previous = -1
+    for number in numbers:
+        if number == previous + 1 and encoded:
+            # Extend the run of consecutive listings, or start one
+            if encoded[-1] < 0:
+                encoded[-1] -= 1
+            else:
+                encoded.append(-1)
+        else:
+            encoded.append(number - previous)
+        previous = number
+    return encoded
+
+def decode_postings(encoded):
+    numbers = []
+    previous = -1
+    for value in encoded:
+        if value > 0:
+            previous += value
+            numbers.append(previous)
+        else:
+            numbers.extend(range(previous + 1, previous + 1 - value))
+            previous -= value
+    return numbers
+
+def split_shards(postings):
+    """Group the words into shards by prefix, splitting shards over MAX_SHARD_SIZE by one more character."""
+    pending = {}
+    for word in sorted(postings):
+        pending.setdefault(word[:PREFIX_LENGTH], []).append(word)
+
+    shards = {}
+    while pending:
+        prefix, words = pending.popitem()
+        shard = {word: encode_postings(postings[word]) for word in words}
+        longer = [word for word in words if len(word) > len(prefix)]
+        if not longer or len(json.dumps(shard, separators=(',', ':'))) <= MAX_SHARD_SIZE:
+            shards[prefix] = shard
+            continue
+        # Words no longer than the prefix itself stay behind
+        if len(longer) < len(words):
+            shards[prefix] = {word: shard[word] for word in words if len(word) == len(prefix)}
+        for word in longer:
+            pending.setdefault(word[:len(prefix) + 1], []).append(word)
+    return dict(sorted(shards.items()))
+
+def shard_prefixes(index, token, partial=False):
+    """Prefixes of the shards that hold token, or every word token starts when partial is set."""
+    holder = max((prefix for prefix in index["shards"] if token.startswith(prefix)), key=len, default=None)
+    prefixes = [holder] if holder else []
+    if partial:
+        prefixes += [prefix for prefix in index["shards"] if len(prefix) > len(token) and prefix.startswith(token)]
+    return prefixes
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(directory, file_name))
+               for directory, _, file_names in os.walk(path) for file_name in file_names)
+
+def build_search_index(listings, output_dir):
+    """Write the search index for listings under output_dir/search and return its index.json."""
+    start = time.perf_counter()
+
+    # Number the listings by price, with unpriced listings last
+    ranked = sorted(listings, key=lambda listing: (listing.list_price is None, listing.list_price or 0))
+    postings = {}
+    for number, listing in enumerate(ranked):
+        for token in set(tokenize(listing_text(listing))):
+            postings.setdefault(token, []).append(number)
+    shards = split_shards(postings)
+
+    # Shards of words that no longer exist must not survive from a previous build
+    search_dir = os.path.join(output_dir, SEARCH_DIR)
+    if os.path.exists(search_dir):
+        shutil.rmtree(search_dir)
+    for folder in ('shards', 'prices', 'bedrooms', 'docs'):
+        os.makedirs(os.path.join(search_dir, folder))
+
+    shard_sizes = {}
+    for prefix, shard in shards.items():
+        shard_path = os.path.join(search_dir, 'shards', f"{prefix}.json")
+        with open(shard_path, 'w') as file:
+            json.dump(shard, file, separators=(',', ':'))
+        shard_sizes[prefix] = os.path.getsize(shard_path)
+
+    prices = [listing.list_price for listing in ranked if listing.list_price is not None]
+    for chunk in range(0, len(prices), PRICE_CHUNK):
+        with open(os.path.join(search_dir, 'prices', f"{chunk // PRICE_CHUNK}.bin"), 'wb') as file:
+            write_typed_array(file, 'd', prices[chunk:chunk + PRICE_CHUNK])
+    bedrooms = [min(255, max(0, int(listing.bedrooms or 0))) for listing in ranked]
+    for chunk in range(0, len(bedrooms), BEDROOM_CHUNK):
+        with open(os.path.join(search_dir, 'bedrooms', f"{chunk // BEDROOM_CHUNK}.bin"), 'wb') as file:
+            write_typed_array(file, 'B', bedrooms[chunk:chunk + BEDROOM_CHUNK])
+
+    for chunk in range(0, len(ranked), DOC_CHUNK):
+        docs = [[listing.mls_id, listing.address, listing.list_price, listing.bedrooms, listing.bathrooms,
+                 listing.area, listing.photo] for listing in ranked[chunk:chunk + DOC_CHUNK]]
+        with open(os.path.join(search_dir, 'docs', f"{chunk // DOC_CHUNK}.json"), 'w') as file:
+            json.dump(docs, file, separators=(',', ':'))
+
+    index = {
+        "count": len(ranked),
+        "prefixLength": PREFIX_LENGTH,
+        "stopWords": sorted(STOP_WORDS),
+        "shards": shard_sizes,
+        "priced": len(prices),
+        "priceChunk": PRICE_CHUNK,
+        "priceSteps": prices[::PRICE_CHUNK],
+        "bedroomChunk": BEDROOM_CHUNK,
+        "docChunk": DOC_CHUNK
+    }
+    with open(os.path.join(search_dir, 'index.json'), 'w') as file:
+        json.dump(index, file, separators=(',', ':'))
+
+    elapsed = time.perf_counter() - start
+    shard_total = sum(shard_sizes.values())
+    print(f"Indexed {len(ranked)} listings ({len(postings)} words) in {elapsed:.2f}s: {len(shards)} shards, "
+          f"{shard_total / 1024:.1f}KB in total, largest {max(shard_sizes.values(), default=0) / 1024:.1f}KB, "
+          f"{directory_size(search_dir) / 1024:.1f}KB with prices and results.")
+    return index
+
+def load_search_index(search_dir):
+    with open(os.path.join(search_dir, 'index.json'), 'r') as file:
+        return json.load(file)
+
+def price_bound(search_dir, index, price, upper):
+    # Number of the first listing priced at or above price, or above it when upper is True
+    search = bisect_right if upper else bisect_left
+    if not index["priceSteps"]:
+        return 0
+    chunk = max(0, search(index["priceSteps"], price) - 1)
+    length = min(index["priceChunk"], index["priced"] - chunk * index["priceChunk"])
+    with open(os.path.join(search_dir, 'prices', f"{chunk}.bin"), 'rb') as file:
+        prices = read_typed_array(file, 'd', length)
+    return chunk * index["priceChunk"] + search(prices, price)
+
+def query_search_index(search_dir, text, min_price=None, max_price=None, min_bedrooms=None):
+    """Listing numbers matching the query, the way search.html finds them.
+
+    Every word must match, the last one as a prefix. A price filter becomes a range of listing
+    numbers, and bedrooms are only read for the chunks of listings still matching.
+    """
+    index = load_search_index(search_dir)
+    tokens = tokenize(text)
+    if not tokens:
+        return []
+
+    shards = {}
+    lists = []
+    for position, token in enumerate(tokens):
+        partial = position == len(tokens) - 1
+        matched = set()
+        for prefix in shard_prefixes(index, token, partial):
+            if prefix not in shards:
+                with open(os.path.join(search_dir, 'shards', f"{prefix}.json"), 'r') as file:
+                    shards[prefix] = json.load(file)
+            for word, encoded in shards[prefix].items():
+                if word == token or (partial and word.startswith(token)):
+                    matched.update(decode_postings(encoded))
+        lists.append(matched)
+
+    lists.sort(key=len)
+    matches = set(lists[0])
+    for numbers in lists[1:]:
+        matches.intersection_update(numbers)
+
+    if min_price is not None or max_price is not None:
+        start = price_bound(search_dir, index, min_price, False) if min_price is not None else 0
+        end = price_bound(search_dir, index, max_price, True) if max_price is not None else index["priced"]
+        matches = {number for number in matches if start <= number < end}
+    if min_bedrooms is not None:
+        chunk_size = index["bedroomChunk"]
+        bedrooms = {}
+        for chunk in {number // chunk_size for number in matches}:
+            length = min(chunk_size, index["count"] - chunk * chunk_size)
+            with open(os.path.join(search_dir, 'bedrooms', f"{chunk}.bin"), 'rb') as file:
+                bedrooms[chunk] = read_typed_array(file, 'B', length)
+        matches = {number for number in matches
+                   if bedrooms[number // chunk_size][number % chunk_size] >= min_bedrooms}
+    return sorted(matches)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the search page and its static search index.')
+    parser.add_argument('template_dir', help='Directory of the HTML templates')
+    parser.add_argument('output_dir', help='Directory to save search.html and the search index')
+    parser.add_argument('json_file', help='JSON file with listings')
+    args = parser.parse_args()
+
+    search_template = load_template(os.path.join(args.template_dir, 'search_template.html'))
+    master_template = load_template(os.path.join(args.template_dir, 'filled_master_template.html'))
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    create_html_page(search_template, master_template, args.output_dir)
+    build_search_index(load_listing_records(args.json_file), args.output_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Shortcode Cache
+
+A persistent memo of shortcode and inline script output for generic_page.py, so unchanged
+shortcodes are not run again on every build.
+
+An entry is keyed by a hash of the script source and its parameters, and records the content
+hash of every data file the script read (through the build's data context) or declared. It is
+reused only while all of those files still have the same content. The entries live in one JSON
+file under .build_cache, and the least recently used ones are evicted once the stored output
+grows past max_bytes.
+
+One cache can be shared by the threads rendering pages in parallel (--workers N): the entries,
+the use clock and the counters are only touched under the cache's lock, and the data files are
+hashed outside it.
+
+Usage:
+from shortcode_cache import ShortcodeCache
+
+cache = ShortcodeCache()
+key = cache.key('script', script_source, params)
+html = cache.lookup(key)
+if html is None:
+    html = run_script()
+    cache.store(key, html, data_files)
+cache.save()
+print(cache.stats())
+"""
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_CACHE = os.path.join('.build_cache', 'shortcodes.json')
+MAX_CACHE_BYTES = 8 * 1024 * 1024
+
+_file_digests = {}
+
+def file_digest(path):
+    """sha256 of a file's content, or None if it does not exist. Hashed once per file version."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_digests.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    _file_digests[path] = (version, digest.hexdigest())
+    return digest.hexdigest()
+
+class ShortcodeCache:
+    def __init__(self, path=DEFAULT_CACHE, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.entries = json.load(file)
+        # Entries remember when they were last used, counted in lookups and stores
+        self.clock = max((entry["used"] for entry in self.entries.values()), default=0)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, *parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def file_digest(self, path):
+        return file_digest(path)
+
+    def tick(self):
+        """The next use time. The caller holds the lock."""
+        self.clock += 1
+        return self.clock
+
+    def lookup(self, key):
+        """The stored output for key, or None if there is none or a file it read has changed."""
+        with self.lock:
+            entry = self.entries.get(key)
+        # Entries are replaced, never changed, apart from "used", so the files can be hashed unlocked
+        fresh = entry and all(self.file_digest(path) == digest for path, digest in entry["files"].items())
+        with self.lock:
+            if fresh:
+                entry["used"] = self.tick()
+                self.hits += 1
+                return entry["output"]
+            self.misses += 1
+            return None
+
+    def files(self, key):
+        """Paths of the data files the entry for key was made from."""
+        with self.lock:
+            return list(self.entries.get(key, {}).get("files", {}))
+
+    def store(self, key, output, files=()):
+        digests = {os.path.abspath(path): self.file_digest(os.path.abspath(path)) for path in files}
+        with self.lock:
+            self.entries[key] = {"files": digests, "output": output, "used": self.tick()}
+
+    def size(self):
+        with self.lock:
+            return self._size()
+
+    def _size(self):
+        return sum(len(entry["output"]) for entry in self.entries.values())
+
+    def save(self):
+        with self.lock:
+            total = self._size()
+            for key in sorted(self.entries, key=lambda key: self.entries[key]["used"]):
+                if total <= self.max_bytes:
+                    break
+                total -= len(self.entries.pop(key)["output"])
+                self.evictions += 1
+
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump(self.entries, file)
+            os.replace(self.path + '.tmp', self.path)
+
+    def stats(self):
+        with self.lock:
+            return (f"Shortcode cache: {self.hits} hits, {self.misses} misses, {self.evictions} evicted, "
+                    f"{len(self.entries)} entries ({self._size() / 1024:.1f}KB).")
@@ -1,9 +1,6 @@
-import json
-
-def generate_content(feedme):
-    # Read and parse the data.json file
-    with open('data.json', 'r') as file:
-        data = json.load(file)
+def generate_content(feedme, context):
+    # The parsed data.json, shared by every page of the build
+    data = context.load_json('data.json')
 
     # CSS to be included in the style tag
     css_content = """
@@ -1,3 +1,6 @@
+# Reads no data files, so its output can be cached
+DATA_FILES = []
+
 def generate_content(params):
     name = params.get('name', 'World')
     return f"<p>Hello, {name}!</p>"
@@ -1,24 +1,19 @@
-import json
-
-def generate_content(params):
+def generate_content(params, context):
     num_listings = int(params.get('number', 3))  # Default to 3 listings if not specified
 
-    # Read and parse the GeoJSON file
-    with open('mls_data.geojson', 'r') as file:
-        data = json.load(file)
+    # The parsed listing data, shared by every page of the build
+    listings = context.load_listings('mls_data.geojson')
 
     # Generate HTML for each listing
     html_output = '<section class="re-listings-section">\n<div class="re-listings-grid">\n'
-    for feature in data["features"][:num_listings]:
-        properties = feature["properties"]
-        formatted_price = "{:,}".format(properties["listPrice"])
-        mls_id = properties["mlsId"]
+    for listing in listings[:num_listings]:
+        formatted_price = "{:,}".format(listing.list_price)
         html_output += f'<div class="re-listing-item">\n'
-        html_output += f'<img src="{properties["listingPhoto"]}" alt="Listing Photo">\n'
-        html_output += f'<p>{properties["fullAddress"]}</p>\n'
-        html_output += f'<p>Bedrooms: {properties["bedrooms"]}, Bathrooms: {properties["bathrooms"]}, Area: {properties["area"]} sqft</p>\n'
+        html_output += f'<img src="{listing.photo}" alt="Listing Photo">\n'
+        html_output += f'<p>{listing.address}</p>\n'
+        html_output += f'<p>Bedrooms: {listing.bedrooms}, Bathrooms: {listing.bathrooms}, Area: {listing.area} sqft</p>\n'
         html_output += f'<p class="re-listing-price">Price: ${formatted_price}</p>\n'
-        html_output += f'<a href="/listing/listing_{mls_id}.html">More Information</a>\n'
+        html_output += f'<a href="/listing/listing_{listing.mls_id}.html">More Information</a>\n'
         html_output += '</div>\n'
     html_output += '</div>\n</section>'
 
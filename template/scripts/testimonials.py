@@ -1,11 +1,8 @@
-import json
-
-def generate_content(params):
+def generate_content(params, context):
     num_testimonials = int(params.get('number', 3))  # Default to 3 testimonials if not specified
 
-    # Read and parse the JSON file
-    with open('testimonials.json', 'r') as file:
-        testimonials = json.load(file)
+    # The parsed JSON file, shared by every page of the build
+    testimonials = context.load_json('testimonials.json')
 
     # Generate HTML for each testimonial
     html_output = '<section class="testimonials">\n<h2>Client Testimonials</h2>\n<div class="testimonials-grid">\n'
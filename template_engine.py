@@ -0,0 +1,105 @@
+"""
+Template Engine
+
+The shared template loader used by the page generators. Templates use the `string.Template`
+syntax (`$name`, `${name}` and `$$`), and rendering produces exactly the same output as
+`string.Template.substitute()` / `safe_substitute()`.
+
+- Each template is parsed once into literal chunks and named slots. Rendering fills the slots
+  and joins the chunks, instead of running the placeholder regex over the whole file again.
+- `load_template()` keeps every compiled template for the rest of the run, keyed by path. A file
+  is only read and compiled again when its modification time or size changes, so generators can
+  call it once per page without re-reading the same template thousands of times.
+
+Usage:
+from template_engine import load_template
+
+master_template = load_template('template/filled_master_template.html')
+html = master_template.safe_substitute(content=page_content)
+"""
+import hashlib
+import os
+from collections import ChainMap
+from string import Template
+
+_compiled_templates = {}
+
+class CompiledTemplate:
+    """A string.Template split once into literal chunks and named slots."""
+    pattern = Template.pattern
+    delimiter = Template.delimiter
+
+    def __init__(self, template):
+        self.template = template
+        # parts alternates literal text and placeholders; slots holds (index into parts, name)
+        self.parts = []
+        self.slots = []
+        self.has_invalid = False
+
+        literal = []
+        position = 0
+        for match in self.pattern.finditer(template):
+            literal.append(template[position:match.start()])
+            position = match.end()
+            name = match.group('named') or match.group('braced')
+            if name is not None:
+                self.parts.append(''.join(literal))
+                literal = []
+                self.slots.append((len(self.parts), name))
+                # An unfilled slot keeps the placeholder text, as safe_substitute does
+                self.parts.append(match.group())
+            elif match.group('escaped') is not None:
+                literal.append(self.delimiter)
+            else:
+                # A lone delimiter is kept by safe_substitute and rejected by substitute
+                self.has_invalid = True
+                literal.append(match.group())
+        literal.append(template[position:])
+        self.parts.append(''.join(literal))
+
+    @property
+    def digest(self):
+        """sha256 of the template source, for build steps that skip work when nothing changed."""
+        return hashlib.sha256(self.template.encode('utf-8')).hexdigest()
+
+    def render(self, mapping, safe):
+        parts = self.parts.copy()
+        for index, name in self.slots:
+            try:
+                parts[index] = str(mapping[name])
+            except KeyError:
+                if not safe:
+                    raise
+        return ''.join(parts)
+
+    def substitute(self, mapping=None, /, **kws):
+        mapping = merge_mapping(mapping, kws)
+        if self.has_invalid:
+            # Let string.Template raise its own error, with the line and column of the placeholder
+            return Template(self.template).substitute(mapping)
+        return self.render(mapping, safe=False)
+
+    def safe_substitute(self, mapping=None, /, **kws):
+        return self.render(merge_mapping(mapping, kws), safe=True)
+
+def merge_mapping(mapping, kws):
+    # Keyword arguments take precedence over the mapping, as in string.Template
+    if mapping is None:
+        return kws
+    if kws:
+        return ChainMap(kws, mapping)
+    return mapping
+
+def load_template(template_path, encoding=None):
+    """Return the compiled template at template_path, compiling it again only if the file changed."""
+    stat = os.stat(template_path)
+    key = (os.path.abspath(template_path), encoding)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _compiled_templates.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    with open(template_path, 'r', encoding=encoding) as file:
+        compiled = CompiledTemplate(file.read())
+    _compiled_templates[key] = (version, compiled)
+    return compiled
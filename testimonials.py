@@ -1,11 +1,7 @@
 import json
 import os
 import argparse
-from string import Template
-
-def load_template(template_path):
-    with open(template_path, 'r') as file:
-        return Template(file.read())
+from template_engine import load_template
 
 def generate_testimonials_html(testimonials):
     testimonials_html = '<div class="testimonials-grid">'
@@ -23,18 +19,14 @@ def generate_testimonials_html(testimonials):
     testimonials_html += '</div>'
     return testimonials_html
 
-def main():
-    parser = argparse.ArgumentParser(description='Generate a Testimonials page.')
-    parser.add_argument('template_dir', help='Directory of the HTML templates')
-    parser.add_argument('output_dir', help='Directory to save the generated HTML file')
-    args = parser.parse_args()
-
+def generate_testimonials_page(template_dir, output_dir):
+    """Write testimonials.html to output_dir and return its path."""
     # Load the master template
-    master_template_path = os.path.join(args.template_dir, 'filled_master_template.html')
+    master_template_path = os.path.join(template_dir, 'filled_master_template.html')
     master_template = load_template(master_template_path)
 
     # Load testimonials data
-    testimonials_path = os.path.join(args.template_dir, 'testimonials.json')
+    testimonials_path = os.path.join(template_dir, 'testimonials.json')
     with open(testimonials_path, 'r') as file:
         testimonials = json.load(file)
 
@@ -45,9 +37,18 @@ def main():
     final_content = master_template.safe_substitute(content=testimonials_html)
 
     # Write to output file
-    output_file_path = os.path.join(args.output_dir, 'testimonials.html')
+    output_file_path = os.path.join(output_dir, 'testimonials.html')
     with open(output_file_path, 'w') as file:
         file.write(final_content)
+    return output_file_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a Testimonials page.')
+    parser.add_argument('template_dir', help='Directory of the HTML templates')
+    parser.add_argument('output_dir', help='Directory to save the generated HTML file')
+    args = parser.parse_args()
+
+    generate_testimonials_page(args.template_dir, args.output_dir)
 
 if __name__ == '__main__':
     main()